@@ -1,15 +1,24 @@
 from flask import Flask, render_template, jsonify, request, Response, stream_with_context
 from gesture_recognition_module import GestureRecognizer
-from google_calendar import get_upcoming_events, get_google_tasks
-from apple_calendar import get_apple_events
+from tasks_sync import get_google_tasks
+import tasks_sync
+import calendar_sync
+import calendar_merge
+import apple_calendar
 from google.auth.exceptions import RefreshError
-from google_email import get_unread_email_count, get_recent_emails
+from gmail_sync import get_unread_email_count, get_recent_emails
+import gmail_sync
+import google_services
 from face_recognition_module import FaceRecognitionModule
+import face_store
+import camera_broker
 from mirror_user import MirrorUser
-import numpy as np
+from weather import get_weather_bundle, peek_weather_bundle, warm_weather_cache, weather_cache, forecast_cache, WEATHER_PLACEHOLDER
+from widget_fetch import Source, refresh_into
+import widget_fetch
+from ttl_cache import TTLCache
 import os
 import datetime
-import requests
 import json
 import threading
 import queue
@@ -49,14 +58,14 @@ def load_users(json_path="users.json"):
     with open(json_path, 'r') as f:
         user_dicts = json.load(f)
 
+    # jeden spakowany magazyn (mmap) zamiast pliku encoding.npy na użytkownika;
+    # ten sam obiekt wykorzystuje potem FaceRecognitionModule
+    store = face_store.get_store()
     users = []
     for u in user_dicts:
-        encoding = None
-        face_encoding_path = os.path.join("known_faces", u["name"], "encoding.npy")
-        try:
-            encoding = np.load(face_encoding_path)
-        except FileNotFoundError:
-            print(f"Brak pliku enkodowania twarzy: {face_encoding_path}, ale rejestruję użytkownika.")
+        gallery = store.gallery(u["name"])
+        if gallery is None:
+            print(f"Brak encodingu twarzy dla {u['name']} w magazynie, ale rejestruję użytkownika.")
 
         user = MirrorUser(
             user_id=u["user_id"],
@@ -64,7 +73,9 @@ def load_users(json_path="users.json"):
             calendar_type=u["calendar_type"],
             email=u.get("email"),
             calendar_data=u.get("calendar_data"),
-            face_encoding=encoding
+            calendars=u.get("calendars"),
+            face_encoding=gallery[0] if gallery is not None else None,
+            face_gallery=gallery
         )
         users.append(user)
     return users
@@ -74,42 +85,31 @@ face_rec_module = FaceRecognitionModule(users)
 
 CURRENT_USER_ID = 1  # Tryb normalny: None, wymuszenie user_id: np. 1
 
-weather_API_KEY = os.getenv("OPENWEATHER_API_KEY")
-CITY = "Kraków"
-if not weather_API_KEY:
-    raise RuntimeError("Brak OPENWEATHER_API_KEY w zmiennych środowiskowych.")
+warm_weather_cache()
+google_services.load_discovery_docs()  # jednorazowo, zanim wątki widżetów zaczną budować serwisy
 
-def get_weather():
-    url = f"https://api.openweathermap.org/data/2.5/weather?q={CITY}&appid={weather_API_KEY}&units=metric&lang=pl"
-    try:
-        response = requests.get(url)
-        data = response.json()
-        return {
-            "temp": round(data['main']['temp']),
-            "desc": data['weather'][0]['description'].capitalize(),
-            "icon": data['weather'][0]['icon']
-        }
-    except Exception as e:
-        print("Błąd pobierania pogody:", e)
-        return {"temp": "?", "desc": "Brak danych", "icon": "01d"}
+USER_SOURCE_DEADLINE = float(os.getenv("USER_SOURCE_DEADLINE", "4.0"))  # s – potem widżet /user dostaje placeholder
 
-def get_weather_forecast():
-    url = f"http://api.openweathermap.org/data/2.5/forecast?q={CITY}&appid={weather_API_KEY}&units=metric&lang=pl"
-    try:
-        response = requests.get(url)
-        data = response.json()
-        forecast_list = data['list'][:4]
-        forecast_data = []
-        for item in forecast_list:
-            dt = datetime.datetime.fromtimestamp(item['dt']).strftime('%H:%M')
-            temp = round(item['main']['temp'])
-            desc = item['weather'][0]['description'].capitalize()
-            icon = item['weather'][0]['icon']
-            forecast_data.append({"time": dt, "temp": temp, "desc": desc, "icon": icon})
-        return forecast_data
-    except Exception as e:
-        print("Błąd prognozy:", e)
-        return []
+# Ostatnie dane widżetów /user per użytkownik: (user_id, źródło) -> dane.
+# /user renderuje się od razu z tego cache, a świeże dane dochodzą przez SSE.
+WIDGET_REFRESH_MIN_AGE = float(os.getenv("WIDGET_REFRESH_MIN_AGE", "30"))  # s – młodszych nie odświeżamy
+widget_cache = TTLCache("widgets", ttl=WIDGET_REFRESH_MIN_AGE, stale_ttl=24 * 3600)
+
+# Prefetch widżetów po rozpoznaniu twarzy (patrz _start_prefetch)
+_prefetch_lock = threading.Lock()
+_prefetch = {"gen": 0, "user_id": None, "started": 0.0, "futures": {}, "done": {}}
+_prefetch_stats = {"started": 0, "cancelled": 0, "used": 0,
+                   "hidden_ms_last": 0.0, "hidden_ms_total": 0.0, "ready_last": None}
+
+# źródło -> fragmenty HTML (nazwa widżetu, szablon, dane źródła -> kontekst szablonu)
+WIDGET_FRAGMENTS = {
+    "weather": [("weather", "widgets/weather.html", lambda d: {"weather": d[0]}),
+                ("forecast", "widgets/forecast.html", lambda d: {"forecast": d[1]})],
+    "calendar": [("calendar", "widgets/calendar.html",
+                  lambda d: {"today_events": d[0], "future_events": d[1]})],
+    "tasks": [("tasks", "widgets/tasks.html", lambda d: {"tasks": d})],
+    "gmail_unread": [("gmail", "widgets/gmail.html", lambda d: {"gmail_unread": d})],
+}
 
 recognized_user_id = None
 recognition_thread = None
@@ -197,6 +197,8 @@ def face_recognition_callback(user_id):
     with recognition_lock:
         recognized_user_id = user_id
     print(f"[APP] Callback: rozpoznano user_id = {user_id}")
+    # dane widżetów zaczynamy pobierać od razu, zanim przeglądarka wejdzie na /user
+    _start_prefetch(user_id)
     # wyślij event do przeglądarki (natychmiastowe przejście na /user)
     _sse_broadcast({"type": "recognized", "user_id": user_id})
 
@@ -355,8 +357,7 @@ def index():
     now = datetime.datetime.now()
     time_str = now.strftime("%H:%M")
     date_str = now.strftime("%A, %d %B %Y")
-    weather = get_weather()
-    forecast = get_weather_forecast()
+    weather, forecast = get_weather_bundle()
     _log_step("index: weather+forecast", t1)
 
     t2 = _t()
@@ -382,16 +383,142 @@ def check_user():
         uid = recognized_user_id
     return jsonify({"recognized": uid is not None, "user_id": uid})
 
+def _drop_google_token(user_id):
+    print(f"[Google] Nie można odświeżyć tokenu dla user_id = {user_id}, usuwam token.")
+    google_services.invalidate(user_id)
+    gmail_sync.forget(user_id)
+    calendar_sync.forget(user_id)
+    calendar_merge.forget(user_id)
+    tasks_sync.forget(user_id)
+    token_path = f"token_{user_id}.pickle"
+    if os.path.exists(token_path):
+        os.remove(token_path)
+
+def _google_call(user_id, fn, *args, **kwargs):
+    """Wywołanie API Google; przy nieważnym tokenie usuwa go i rzuca dalej."""
+    try:
+        return fn(user_id, *args, **kwargs)
+    except (RefreshError, MemoryError):
+        _drop_google_token(user_id)
+        raise
+
+def _user_sources(user):
+    """Źródła danych widżetów /user dla danego użytkownika (placeholder = pusty widżet)."""
+    uid = user.user_id
+    no_calendar = ([], [])
+    # wszystkie kalendarze użytkownika (Google i ICS) scalone w jeden widżet
+    calendars = calendar_merge.user_calendars(user)
+    calendar_fn = lambda: _google_call(uid, calendar_merge.get_upcoming_events, calendars)
+    if user.calendar_type == "google":
+        tasks_fn = lambda: _google_call(uid, get_google_tasks)
+    else:
+        tasks_fn = lambda: []
+
+    return [
+        Source("weather", get_weather_bundle, placeholder=(dict(WEATHER_PLACEHOLDER), []),
+               deadline=USER_SOURCE_DEADLINE),
+        Source("calendar", calendar_fn, placeholder=no_calendar, deadline=USER_SOURCE_DEADLINE),
+        Source("tasks", tasks_fn, placeholder=[], deadline=USER_SOURCE_DEADLINE),
+        Source("gmail_unread", lambda: _google_call(uid, get_unread_email_count),
+               placeholder=None, deadline=USER_SOURCE_DEADLINE),
+        Source("gmail_preview", lambda: _google_call(uid, get_recent_emails, max_results=5),
+               placeholder=[], deadline=USER_SOURCE_DEADLINE),
+    ]
+
+def _render_widget_fragments(source_name, value):
+    """Renderuje fragmenty HTML widżetów zasilanych przez dane źródło (poza requestem)."""
+    fragments = {}
+    with app.app_context():
+        for widget, template, ctx in WIDGET_FRAGMENTS.get(source_name, []):
+            fragments[widget] = render_template(template, **ctx(value))
+    return fragments
+
+def _refresh_user_widgets(user, sources=None, tag="user", on_done=None):
+    """Odświeża widżety użytkownika w tle; każdy gotowy widżet leci od razu przez SSE."""
+    uid = user.user_id
+
+    def publish(name, value):
+        for widget, html in _render_widget_fragments(name, value).items():
+            _sse_broadcast({"type": "widget", "user_id": uid, "name": widget, "html": html})
+        if on_done is not None:
+            on_done(name)
+
+    def timed_out(name, placeholder):
+        # źródło wisi ponad deadline – pusty widżet zamiast wiecznego "ładowania"
+        # (wartość z cache, jeśli jest, strona już pokazuje)
+        if widget_cache.peek((uid, name)) is None:
+            for widget, html in _render_widget_fragments(name, placeholder).items():
+                _sse_broadcast({"type": "widget", "user_id": uid, "name": widget, "html": html})
+
+    return refresh_into(widget_cache, uid, sources or _user_sources(user),
+                        on_result=publish, tag=tag, min_age=WIDGET_REFRESH_MIN_AGE,
+                        on_timeout=timed_out)
+
+def _start_prefetch(user_id):
+    """
+    Spekulatywny prefetch widżetów zaraz po rozpoznaniu twarzy – zanim przeglądarka
+    zdąży przejść na /user. Rozpoznanie innej osoby anuluje zadania, które jeszcze
+    nie ruszyły (trwające pobrania kończą się, ale ich wynik nie liczy się do statystyk).
+    """
+    user = next((u for u in users if u.user_id == user_id), None)
+    if not user:
+        return
+    with _prefetch_lock:
+        if _prefetch["user_id"] == user_id and _prefetch["started"]:
+            return  # ten sam użytkownik – prefetch już trwa albo czeka na /user
+        cancelled = sum(1 for f in _prefetch["futures"].values() if f.cancel())
+        if cancelled:
+            _prefetch_stats["cancelled"] += cancelled
+            print(f"[PREFETCH] Anulowano {cancelled} zadań dla user_id={_prefetch['user_id']}")
+        gen = _prefetch["gen"] + 1
+        _prefetch.update(gen=gen, user_id=user_id, started=_t(), futures={}, done={})
+        _prefetch_stats["started"] += 1
+
+    def on_done(name):
+        with _prefetch_lock:
+            if _prefetch["gen"] == gen:
+                _prefetch["done"][name] = _t()
+
+    futures = _refresh_user_widgets(user, tag="prefetch", on_done=on_done)
+    with _prefetch_lock:
+        if _prefetch["gen"] == gen:
+            _prefetch["futures"] = futures
+    print(f"[PREFETCH] user_id={user_id}: start {len(futures)} źródeł")
+
+def _consume_prefetch(user_id):
+    """
+    Wywoływane przez /user: ile czasu pobierania schował prefetch. Źródło gotowe przed
+    /user ukryło cały swój czas, niegotowe – czas od startu prefetchu do teraz.
+    Źródła idą równolegle, więc zysk dla strony to maksimum po źródłach.
+    """
+    with _prefetch_lock:
+        if _prefetch["user_id"] != user_id or not _prefetch["started"]:
+            return
+        t_user = _t()
+        t0 = _prefetch["started"]
+        names = list(_prefetch["futures"])
+        done = dict(_prefetch["done"])
+        _prefetch["started"] = 0.0  # jednorazowo – kolejne odświeżenia /user się nie liczą
+        if not names:
+            return
+        hidden_ms = max((done.get(n, t_user) - t0) * 1000 for n in names)
+        _prefetch_stats["used"] += 1
+        _prefetch_stats["hidden_ms_last"] = round(hidden_ms, 1)
+        _prefetch_stats["hidden_ms_total"] += round(hidden_ms, 1)
+        _prefetch_stats["ready_last"] = f"{len(done)}/{len(names)}"
+    print(f"[PERF] prefetch: user_id={user_id}: gotowe {len(done)}/{len(names)} źródeł, "
+          f"ukryto {hidden_ms:.1f} ms pobierania")
+
 @app.route('/user')
 def index_user():
     t0 = _t()
     global recognized_user_id, asystent_thread
     with recognition_lock:
         user_id = recognized_user_id
-    # koniec rozpoznawanie twarzy, żeby zwolnić kamerę
+    # koniec rozpoznawania twarzy (rezygnuje z subskrypcji wspólnej kamery)
     face_rec_module.stop_recognition()
 
-    #rozpoznawanie gestów (kamera przechodzi do GestureRecognizer)
+    #rozpoznawanie gestów (nowy subskrybent camera_broker – kamera zostaje otwarta)
     start_gesture_recognition()
 
     if not (asystent_thread and asystent_thread.is_alive()):
@@ -400,15 +527,10 @@ def index_user():
         print("🔊 Wątek nasłuchiwania hotworda uruchomiony.")
     _log_step("user: stop_recognition + hotword_thread", t0)
 
-    t1 = _t()
     now = datetime.datetime.now()
     time_str = now.strftime("%H:%M")
     date_str = now.strftime("%A, %d %B %Y")
 
-    weather = get_weather()
-    forecast = get_weather_forecast()
-    _log_step("user: weather+forecast", t1)
-
     t2 = _t()
     # Czujnik iNode_ht z cache (nie blokuje requestu)
     _ensure_sensor_thread()
@@ -420,44 +542,21 @@ def index_user():
     current_user = next((u for u in users if u.user_id == user_id), None)
     if not current_user:
         return "Użytkownik nie znaleziony", 404
-   # Kalendarz
-    t3 = _t()
-    today_events, future_events, tasks = [], [], []
-    if current_user.calendar_type == "google":
-        try:
-            today_events, future_events = get_upcoming_events(current_user.user_id)
-            tasks = get_google_tasks(current_user.user_id)
-        except (RefreshError, MemoryError):
-            print(f"[Google] Nie można odświeżyć tokenu dla user_id = {current_user.user_id}, usuwam token.")
-            token_path = f"token_{current_user.user_id}.pickle"
-            if os.path.exists(token_path):
-                os.remove(token_path)
-            today_events, future_events, tasks = [], [], []
-    elif current_user.calendar_type == "apple":
-        today_events, future_events = get_apple_events(current_user.calendar_data)
-        tasks = []
-    else:
-        today_events, future_events, tasks = [], [], []
-    _log_step("user: calendars+tasks", t3)
 
-    # Gmail
-    t4 = _t()
-    gmail_unread = None
-    gmail_preview = []
-    try:
-        gmail_unread = get_unread_email_count(current_user.user_id)
-        gmail_preview = get_recent_emails(current_user.user_id, max_results=5)
-    except (RefreshError, MemoryError):
-        # np. brak ważnego tokena – możesz dodać loga
-        token_path = f"token_{current_user.user_id}.pickle"
-        if os.path.exists(token_path):
-            os.remove(token_path)
-        gmail_unread, gmail_preview = None, []
-    except Exception as e:
-        # jak Gmail padnie
-        print(f"[Gmail] Błąd pobierania maili dla user_id={current_user.user_id}: {e}")
-        gmail_unread, gmail_preview = None, []
-        _log_step("user: emails", t4)
+    # Shell od razu: dane z cache (albo placeholdery), świeże widżety dojdą przez SSE
+    t3 = _t()
+    _consume_prefetch(current_user.user_id)
+    sources = _user_sources(current_user)
+    data = {src.name: widget_cache.peek((current_user.user_id, src.name), src.placeholder)
+            for src in sources}
+    # cache pogody jest wspólny z ekranem głównym, więc zwykle jest cieplejszy
+    weather, forecast = peek_weather_bundle(data["weather"])
+    today_events, future_events = data["calendar"]
+    tasks = data["tasks"]
+    gmail_unread = data["gmail_unread"]
+    gmail_preview = data["gmail_preview"]
+    _refresh_user_widgets(current_user, sources)
+    _log_step("user: shell z cache + start odświeżania", t3)
 
     _log_step("user: TOTAL do render_template", t0)
     return render_template("index_user.html",
@@ -468,6 +567,18 @@ def index_user():
                            tasks=tasks, user=current_user,
                            gmail_unread=gmail_unread, gmail_preview=gmail_preview)
 
+@app.route('/user/widgets')
+def user_widgets():
+    """Fragmenty widżetów, które już są w cache – strona dociąga je po połączeniu z SSE."""
+    with recognition_lock:
+        user_id = recognized_user_id
+    widgets = {}
+    for name in WIDGET_FRAGMENTS:
+        value = widget_cache.peek((user_id, name))
+        if value is not None:
+            widgets.update(_render_widget_fragments(name, value))
+    return jsonify({"user_id": user_id, "widgets": widgets})
+
 @app.route('/check_hotword')
 def check_hotword():
     global hotword_detected
@@ -518,6 +629,15 @@ def api_sensors():
             "ts": _sensor_cache.get("ts")
         })
 
+@app.get("/api/cache_stats")
+def api_cache_stats():
+    return jsonify({"weather": weather_cache.stats(), "forecast": forecast_cache.stats(), "widgets": widget_cache.stats(),
+                    "google": google_services.stats(), "gmail": gmail_sync.stats(),
+                    "calendar": calendar_sync.stats(), "calendar_merge": calendar_merge.stats(), "tasks": tasks_sync.stats(),
+                    "faces": face_store.stats(), "face_recognition": face_rec_module.stats(),
+                    "ics": apple_calendar.stats(), "camera": camera_broker.stats(),
+                    "fetch": widget_fetch.stats(), "prefetch": dict(_prefetch_stats)})
+
 @app.post("/api/ensure_recognition")
 def api_ensure_recognition():
     # jeśli wątek działa, nic się nie stanie; jeśli nie, zostanie uruchomiony
@@ -552,10 +672,7 @@ def user_email():
         emails = get_recent_emails(current_user.user_id, max_results=10) # ile maili ma pobrać
 
     except (RefreshError, MemoryError):
-        print(f"[Gmail] Nie można odświeżyć tokenu dla user_id = {current_user.user_id}, usuwam token.")
-        token_path = f"token_{current_user.user_id}.pickle"
-        if os.path.exists(token_path):
-            os.remove(token_path)
+        _drop_google_token(current_user.user_id)
         error = "Brak ważnej autoryzacji Gmail dla tego użytkownika."
         emails = []
 
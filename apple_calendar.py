@@ -1,37 +1,206 @@
-import requests
-from ics import Calendar
-from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import threading
+import time
+import http_client
+from ics_stream import iter_window_events, DEFAULT_TZ
+from datetime import datetime, timedelta, timezone
+
+ICS_CACHE_DIR = "cache"        # sparsowane kalendarze przeżywają restart aplikacji
+ICS_RECHECK_INTERVAL = 300     # s – częściej nie pytamy serwera nawet warunkowo
+ICS_WINDOW_DAYS = int(os.getenv("ICS_WINDOW_DAYS", "60"))   # ile dni do przodu materializujemy
+ICS_WINDOW_MIN_LEFT = timedelta(days=7)   # gdy okno się kończy – pobieramy całość od nowa
+
+_lock = threading.Lock()
+_feed_locks = {}   # url -> Lock (jedno pobranie danego kalendarza naraz)
+_feeds = {}        # url -> {"etag", "last_modified", "events", "window_end", "checked_at"}
+_stats = {"downloads": 0, "not_modified": 0, "parses": 0, "memory_hits": 0}
+
+
+def _feed_lock(url):
+    with _lock:
+        lock = _feed_locks.get(url)
+        if lock is None:
+            lock = _feed_locks[url] = threading.Lock()
+        return lock
+
+
+def _cache_path(url):
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(ICS_CACHE_DIR, f"ics_{digest}.json")
+
+
+def _load_feed(url):
+    path = _cache_path(url)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[ICS] Uszkodzony cache {path}: {e}")
+        return None
+
+
+def _save_feed(url, feed):
+    os.makedirs(ICS_CACHE_DIR, exist_ok=True)
+    path = _cache_path(url)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(feed, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _same_content(a, b):
+    """Czy dwa rekordy kalendarza różnią się tylko czasem ostatniego sprawdzenia."""
+    if a is None or b is None:
+        return False
+    return {k: v for k, v in a.items() if k != "checked_at"} == {k: v for k, v in b.items() if k != "checked_at"}
+
+
+def _window(now):
+    """Okno od dzisiejszej północy (czas lokalny) na ICS_WINDOW_DAYS dni do przodu."""
+    start = now.astimezone(DEFAULT_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=ICS_WINDOW_DAYS)
+
+
+def _parse_upcoming(lines, now):
+    """
+    Strumieniowo parsuje kalendarz i zostawia tylko wystąpienia z okna
+    (z rozwiniętymi RRULE), posortowane po starcie, w zwartej postaci do JSON.
+    """
+    window_start, window_end = _window(now)
+    events = [
+        (occ["start"], occ)
+        for occ in iter_window_events(lines, window_start, window_end)
+    ]
+    events.sort(key=lambda item: item[0])
+    upcoming = [{
+        "title": occ["title"],
+        "start": occ["start"].isoformat(),
+        "end": occ["end"].isoformat(),
+        "all_day": occ["all_day"],
+    } for _, occ in events]
+    return upcoming, window_end.isoformat()
+
+
+def _window_expiring(feed, now):
+    window_end = feed.get("window_end")
+    if not window_end:
+        return True   # cache sprzed parsera okienkowego
+    return datetime.fromisoformat(window_end) - now < ICS_WINDOW_MIN_LEFT
+
+
+def _get_feed(calendar_url):
+    """
+    Zwraca sparsowany kalendarz z pamięci/dysku; z serwerem rozmawia najwyżej
+    co ICS_RECHECK_INTERVAL i to zapytaniem warunkowym (ETag/Last-Modified).
+    Parsowanie tylko wtedy, gdy serwer oddał nową treść albo kończy się okno.
+    """
+    now = datetime.now(timezone.utc)
+    with _feed_lock(calendar_url):
+        with _lock:
+            feed = _feeds.get(calendar_url)
+        if feed is None:
+            feed = _load_feed(calendar_url)
+        if feed is not None and _window_expiring(feed, now):
+            feed = dict(feed, etag=None, last_modified=None, checked_at=0)
+        if feed is not None and time.time() - feed["checked_at"] < ICS_RECHECK_INTERVAL:
+            _stats["memory_hits"] += 1
+            with _lock:
+                _feeds[calendar_url] = feed
+            return feed
+
+        headers = {}
+        if feed is not None:
+            if feed.get("etag"):
+                headers["If-None-Match"] = feed["etag"]
+            if feed.get("last_modified"):
+                headers["If-Modified-Since"] = feed["last_modified"]
+
+        cached = feed
+        try:
+            # stream=True – parser czyta linie w miarę ich przychodzenia
+            r = http_client.get(calendar_url, headers=headers, stream=True)
+            with r:
+                if r.status_code != 304:
+                    r.raise_for_status()
+                if r.status_code == 304 and feed is not None:
+                    _stats["not_modified"] += 1
+                    feed = dict(feed, checked_at=time.time())
+                else:
+                    if 'charset' not in r.headers.get('Content-Type', ''):
+                        r.encoding = 'utf-8'   # RFC 5545: domyślnie UTF-8, nie ISO-8859-1
+                    _stats["downloads"] += 1
+                    events, window_end = _parse_upcoming(r.iter_lines(decode_unicode=True), now)
+                    _stats["parses"] += 1
+                    feed = {
+                        "etag": r.headers.get("ETag"),
+                        "last_modified": r.headers.get("Last-Modified"),
+                        "events": events,
+                        "window_end": window_end,
+                        "checked_at": time.time(),
+                    }
+        except Exception as e:
+            if feed is None:
+                raise
+            # serwer niedostępny – lepiej pokazać ostatnią znaną wersję niż pusty widżet
+            print(f"[ICS] Błąd odświeżania kalendarza, używam kopii z cache: {e}")
+            return feed
+
+        # 304 (i ta sama treść bez ETag) zmienia tylko checked_at – ten trzymamy w pamięci,
+        # po restarcie najwyżej jedno dodatkowe zapytanie warunkowe
+        if not _same_content(cached, feed):
+            _save_feed(calendar_url, feed)
+        with _lock:
+            _feeds[calendar_url] = feed
+        return feed
+
+
+def get_feed_events(calendar_url):
+    """
+    Lista wydarzeń kalendarza (posortowana po starcie) z cache – ten sam obiekt,
+    dopóki treść się nie zmieni, więc wywołujący może po nim poznać brak zmian.
+    """
+    return _get_feed(calendar_url)["events"]
+
 
 def get_apple_events(calendar_url):
     try:
-        r = requests.get(calendar_url)
-        r.raise_for_status()
-        calendar = Calendar(r.text)
+        feed = _get_feed(calendar_url)
         now = datetime.now(timezone.utc)
         today_events = []
         future_events = []
 
-        for event in calendar.events:
-            start = event.begin.datetime
-            if start.date() == now.date():
+        for item in feed["events"]:
+            start = datetime.fromisoformat(item["start"]).astimezone(DEFAULT_TZ)
+            if start.date() == now.astimezone(DEFAULT_TZ).date():
                 today_events.append({
-                    "title": event.name,
+                    "title": item["title"],
                     "date_str": start.strftime("%d.%m"),
                     "sort_date": start.date(),
                     "is_today": True,
-                    "time": start.strftime("%H:%M") if start.time() != datetime.min.time() else None
+                    "time": None if item.get("all_day") else start.strftime("%H:%M")
                 })
             elif start > now:
                 future_events.append({
-                    "title": event.name,
+                    "title": item["title"],
                     "date_str": start.strftime("%d.%m"),
                     "sort_date": start.date(),
                     "is_today": False,
-                    "time": start.strftime("%H:%M") if start.time() != datetime.min.time() else None
+                    "time": None if item.get("all_day") else start.strftime("%H:%M")
                 })
+                if len(future_events) >= 3:
+                    break  # wydarzenia są posortowane po starcie – dalej same późniejsze
 
         future_events = sorted(future_events, key=lambda x: x["sort_date"])[:3]
         return today_events, future_events
     except Exception as e:
         print("Błąd pobierania kalendarza Apple:", e)
         return [], []
+
+
+def stats():
+    with _lock:
+        return {**_stats, "feeds": len(_feeds)}
@@ -0,0 +1,218 @@
+# calendar_merge.py
+"""
+Łączenie kilku kalendarzy użytkownika (Google + ICS) w jeden widżet.
+
+Każde źródło daje już posortowany po starcie strumień wydarzeń
+(indeks calendar_sync albo cache apple_calendar), więc scalamy je
+heapq.merge, a zapytania "dziś" / "najbliższe N" obsługuje MergedIndex.
+Scalony indeks jest przebudowywany tylko wtedy, gdy zmieni się któreś źródło.
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from google.auth.exceptions import RefreshError
+import calendar_sync
+import apple_calendar
+from google_calendar import TZ
+
+CALENDAR_WORKERS = 4     # równoległe źródła jednego użytkownika
+FUTURE_LIMIT = 3         # ile przyszłych wydarzeń pokazuje widżet
+LONG_EVENT = timedelta(days=1)   # dłuższe wydarzenia MergedIndex sprawdza osobno
+
+MergedEvent = namedtuple("MergedEvent", "start end title all_day calendar source")
+
+_executor = ThreadPoolExecutor(max_workers=CALENDAR_WORKERS, thread_name_prefix="calendar_merge")
+_lock = threading.Lock()
+_merged = {}       # user_id -> (wersje źródeł, MergedIndex)
+_stats = {"merges": 0, "reused": 0, "source_errors": 0}
+
+
+def _ics_url(url):
+    """webcal:// to zwykłe HTTPS (iCloud itp.), a requests nie zna tego schematu."""
+    if url.startswith("webcal://"):
+        return "https://" + url[len("webcal://"):]
+    return url
+
+
+def user_calendars(user):
+    """
+    Lista kalendarzy użytkownika: [{"type": "google", "id": ...} | {"type": "ics", "url": ...}].
+    W users.json pole "calendars" może mieszać oba rodzaje (sam string: URL -> ICS, inaczej calendarId);
+    bez niego zachowujemy stare calendar_type/calendar_data.
+    """
+    calendars = []
+    for entry in getattr(user, "calendars", None) or []:
+        if isinstance(entry, str):
+            if entry.startswith(("http://", "https://", "webcal://")):
+                entry = {"type": "ics", "url": entry}
+            else:
+                entry = {"type": "google", "id": entry}
+        if entry.get("type") == "ics" and entry.get("url"):
+            entry = dict(entry, url=_ics_url(entry["url"]))
+        calendars.append(entry)
+    if calendars:
+        return calendars
+    if user.calendar_type == "google":
+        return [{"type": "google", "id": "primary"}]
+    if user.calendar_type == "apple" and user.calendar_data:
+        return [{"type": "ics", "url": _ics_url(user.calendar_data)}]
+    return []
+
+
+# ---------------- Źródła ----------------
+def _google_stream(index, label):
+    for start, end, event in index.iter_events():
+        yield MergedEvent(start, end, event.get('summary', 'Bez tytułu'),
+                          'date' in event['start'], label, "google")
+
+
+def _ics_stream(events, label):
+    for item in events:
+        start = datetime.fromisoformat(item["start"]).astimezone(TZ)
+        end = datetime.fromisoformat(item.get("end") or item["start"]).astimezone(TZ)
+        yield MergedEvent(start, end, item["title"], item.get("all_day", False), label, "ics")
+
+
+def _load_source(user_id, calendar):
+    """(wersja, strumień) jednego kalendarza; wersja to obiekt danych źródła (porównywany przez is)."""
+    if calendar["type"] == "google":
+        calendar_id = calendar.get("id", "primary")
+        index = calendar_sync.get_index(user_id, calendar_id)
+        return index, lambda: _google_stream(index, calendar.get("name", calendar_id))
+    if calendar["type"] == "ics":
+        events = apple_calendar.get_feed_events(calendar["url"])
+        return events, lambda: _ics_stream(events, calendar.get("name", calendar["url"]))
+    raise ValueError(f"Nieznany typ kalendarza: {calendar['type']}")
+
+
+# ---------------- Indeks ----------------
+def _midnight(day):
+    """Lokalna północ danego dnia (pytz – poprawny offset także w dni zmiany czasu)."""
+    return TZ.localize(datetime.combine(day, datetime.min.time()))
+
+
+class MergedIndex:
+    """
+    Scalone wydarzenia jako lista posortowana po starcie. Wydarzenia trwające
+    w danej chwili: bisect po starcie cofnięty o najdłuższe "krótkie" wydarzenie
+    (<= LONG_EVENT), więc cofanie obejmuje najwyżej dobę wydarzeń; nieliczne
+    długie (np. wielotygodniowe całodniowe) trzymamy osobno i sprawdzamy wprost.
+    """
+
+    def __init__(self, streams):
+        self.events = list(heapq.merge(*streams, key=lambda ev: ev.start))
+        self.starts = [ev.start for ev in self.events]
+        self.long_events = [ev for ev in self.events if ev.end - ev.start > LONG_EVENT]
+        self.max_short = max((ev.end - ev.start for ev in self.events if ev.end - ev.start <= LONG_EVENT),
+                             default=timedelta(0))
+
+    def overlapping(self, since, until):
+        """Wydarzenia przecinające [since, until), rosnąco po starcie."""
+        hi = bisect.bisect_left(self.starts, until)
+        window_start = since - self.max_short
+        lo = bisect.bisect_left(self.starts, window_start, 0, hi)
+        recent = [ev for ev in self.events[lo:hi] if ev.end > since]
+        older_long = [ev for ev in self.long_events if ev.start < window_start and ev.end > since]
+        return older_long + recent
+
+    def today(self, now):
+        """
+        Wydarzenia zaczynające się dziś: z Google te, które się jeszcze nie skończyły
+        (jak dawne timeMin=now), z ICS cały dzień (jak dawne get_apple_events).
+        """
+        lo = bisect.bisect_left(self.starts, _midnight(now.date()))
+        hi = bisect.bisect_left(self.starts, _midnight(now.date() + timedelta(days=1)), lo)
+        return [ev for ev in self.events[lo:hi] if ev.source == "ics" or ev.end > now]
+
+    def upcoming(self, now, limit):
+        """Najbliższe niedzisiejsze wydarzenia: najpierw trwające, potem od jutra."""
+        midnight = _midnight(now.date())
+        tomorrow = _midnight(now.date() + timedelta(days=1))
+        result = [ev for ev in self.overlapping(now, midnight) if ev.start < midnight]
+        i = bisect.bisect_left(self.starts, tomorrow)
+        result.extend(self.events[i:i + max(0, limit - len(result))])
+        return result[:limit]
+
+
+def _view(ev, today_date):
+    """Słownik dla szablonu, jak google_calendar.event_view."""
+    start = ev.start.astimezone(TZ)
+    if ev.all_day:
+        last_day = (ev.end.astimezone(TZ) - timedelta(days=1)).date()
+        start_date = start.date()
+        if last_day > start_date:
+            date_str = f"{start_date.strftime('%d.%m')}–{last_day.strftime('%d.%m')}"
+        else:
+            date_str = start_date.strftime('%d.%m')
+        time_str = None
+    else:
+        date_str = start.strftime('%d.%m')
+        time_str = start.strftime("%H:%M")
+        time_str = None if time_str == "00:00" else time_str
+    return {
+        "title": ev.title,
+        "date_str": date_str,
+        "sort_date": start.date(),
+        "is_today": start.date() == today_date,
+        "time": time_str,
+    }
+
+
+def get_index(user_id, calendars):
+    """Scalony indeks; źródła pobierane równolegle, scalanie tylko po zmianie któregoś z nich."""
+    futures = [(cal, _executor.submit(_load_source, user_id, cal)) for cal in calendars]
+    versions, factories = [], []
+    for cal, fut in futures:
+        try:
+            version, factory = fut.result()
+        except RefreshError:
+            raise  # token Google – obsługuje app._google_call
+        except Exception as e:
+            # jeden niedostępny kalendarz nie może wyczyścić całego widżetu
+            _stats["source_errors"] += 1
+            print(f"[Calendar] Pomijam kalendarz {cal}: {e}")
+            version, factory = None, None
+        versions.append(version)
+        factories.append(factory)
+
+    with _lock:
+        cached = _merged.get(user_id)
+    if cached is not None and len(cached[0]) == len(versions) \
+            and all(a is b for a, b in zip(cached[0], versions)):
+        _stats["reused"] += 1
+        return cached[1]
+
+    t0 = time.perf_counter()
+    index = MergedIndex(f() for f in factories if f is not None)
+    _stats["merges"] += 1
+    print(f"[PERF] calendar_merge: user_id={user_id}: {len(index.events)} wydarzeń "
+          f"z {len(calendars)} kalendarzy: {(time.perf_counter() - t0) * 1000:.1f} ms")
+    with _lock:
+        _merged[user_id] = (versions, index)
+    return index
+
+
+def get_upcoming_events(user_id, calendars):
+    """(today_events, future_events) ze wszystkich kalendarzy użytkownika."""
+    if not calendars:
+        return [], []
+    index = get_index(user_id, calendars)
+    now = datetime.now(TZ)
+    today = now.date()
+    return ([_view(ev, today) for ev in index.today(now)],
+            [_view(ev, today) for ev in index.upcoming(now, FUTURE_LIMIT)])
+
+
+def forget(user_id):
+    with _lock:
+        _merged.pop(user_id, None)
+
+
+def stats():
+    with _lock:
+        sizes = {str(u): len(entry[1].events) for u, entry in _merged.items()}
+    return {**_stats, "events": sizes}
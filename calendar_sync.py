@@ -0,0 +1,298 @@
+# calendar_sync.py
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from googleapiclient.errors import HttpError
+from google_services import get_service
+from google_calendar import TZ, event_bounds, event_view
+
+SYNC_INTERVAL = 120      # s – co ile wątek w tle pobiera zmiany (syncToken)
+KEEP_PAST = timedelta(days=1)   # zakończone wydarzenia trzymamy jeszcze dobę, potem wylatują
+SYNC_WINDOW_DAYS = int(os.getenv("CALENDAR_SYNC_DAYS", "60"))   # timeMax pełnej synchronizacji (dni do przodu)
+SYNC_WINDOW_MIN_LEFT = timedelta(days=7)   # gdy okno się kończy – pełna synchronizacja z nowym oknem
+FUTURE_LIMIT = 3         # ile przyszłych wydarzeń pokazuje widżet
+EVENT_FIELDS = 'items(id,status,summary,start,end),nextPageToken,nextSyncToken'
+
+_lock = threading.Lock()
+_key_locks = {}    # (user_id, calendar_id) -> Lock
+_stores = {}       # (user_id, calendar_id) -> {"sync_token", "events", "synced_at"}
+_indexes = {}      # (user_id, calendar_id) -> EventIndex
+_sync_thread = None
+_stats = {"full_syncs": 0, "tokenless_syncs": 0, "delta_syncs": 0, "delta_changes": 0, "errors": 0}
+
+
+class EventIndex:
+    """
+    Wydarzenia pogrupowane po lokalnej dacie rozpoczęcia:
+    by_date[data] -> lista (start, end, event) posortowana po starcie,
+    dates -> posortowana lista dat (bisect dla zapytań "od dnia X").
+    """
+
+    def __init__(self, events, tz=TZ):
+        self.tz = tz
+        self.by_date = {}
+        for event in events:
+            try:
+                start, end = event_bounds(event, tz)
+            except (KeyError, ValueError):
+                continue
+            self.by_date.setdefault(start.date(), []).append((start, end, event))
+        for items in self.by_date.values():
+            items.sort(key=lambda item: item[0])
+        self.dates = sorted(self.by_date)
+
+    def today(self, now):
+        """Dzisiejsze wydarzenia, które się jeszcze nie skończyły."""
+        return [ev for start, end, ev in self.by_date.get(now.date(), []) if end > now]
+
+    def upcoming(self, now, limit):
+        """Najbliższe niedzisiejsze wydarzenia, które trwają lub się zaczną (jak timeMin=now)."""
+        today = now.date()
+        result = []
+        cut = bisect.bisect_left(self.dates, today)
+        # trwające wydarzenia rozpoczęte przed dziś (np. wielodniowe) idą na początek
+        for day in self.dates[:cut]:
+            result.extend(ev for start, end, ev in self.by_date[day] if end > now)
+        for day in self.dates[cut:]:
+            if len(result) >= limit:
+                break
+            if day == today:
+                continue
+            result.extend(ev for start, end, ev in self.by_date[day])
+        return result[:limit]
+
+    def iter_events(self):
+        """Wszystkie wydarzenia (start, end, event) rosnąco po starcie."""
+        for day in self.dates:
+            yield from self.by_date[day]
+
+
+def _store_path(user_id, calendar_id):
+    safe = "".join(c if c.isalnum() else "_" for c in calendar_id)
+    return f'calendar_store_{user_id}_{safe}.json'
+
+
+def _key_lock(key):
+    with _lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = _key_locks[key] = threading.Lock()
+        return lock
+
+
+def _load_store(key):
+    path = _store_path(*key)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Calendar] Uszkodzony magazyn {path}, pełna synchronizacja: {e}")
+    return {"sync_token": None, "events": {}, "synced_at": 0.0}
+
+
+def _save_store(key, store):
+    path = _store_path(*key)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(store, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _compact(event):
+    """Z wydarzenia API zostawiamy tylko pola potrzebne do widżetu."""
+    return {"summary": event.get('summary', 'Bez tytułu'), "start": event['start'], "end": event['end']}
+
+
+def _prune(events, now, window_end=None):
+    """Zostawia wydarzenia z okna [now - KEEP_PAST, window_end] – delta potrafi przysłać
+    wszystkie wystąpienia zmienionej serii bez końca, daleko poza oknem."""
+    horizon = now - KEEP_PAST
+    far = datetime.fromisoformat(window_end) if window_end else None
+    kept = {}
+    for event_id, event in events.items():
+        try:
+            start, end = event_bounds(event)
+        except (KeyError, ValueError):
+            continue
+        if end >= horizon and (far is None or start <= far):
+            kept[event_id] = event
+    return kept
+
+
+def _window_expiring(store, now):
+    """Brak okna (stary magazyn) albo jego koniec blisko – delta nie dośle wydarzeń spoza okna."""
+    window_end = store.get("window_end")
+    return not window_end or datetime.fromisoformat(window_end) - now < SYNC_WINDOW_MIN_LEFT
+
+
+def _list_pages(service, calendar_id, **params):
+    page_token = None
+    while True:
+        resp = service.events().list(
+            calendarId=calendar_id, singleEvents=True, maxResults=250,
+            fields=EVENT_FIELDS, pageToken=page_token, **params
+        ).execute()
+        yield resp
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def _full_sync(service, calendar_id, now):
+    # singleEvents rozwija serie – bez timeMax seria bez UNTIL dałaby setki wystąpień
+    time_min = (now - KEEP_PAST).isoformat()
+    window_end = (now + timedelta(days=SYNC_WINDOW_DAYS)).isoformat()
+    events = {}
+    sync_token = None
+    for resp in _list_pages(service, calendar_id, timeMin=time_min, timeMax=window_end):
+        for event in resp.get('items', []):
+            if event.get('status') != 'cancelled' and 'start' in event:
+                events[event['id']] = _compact(event)
+        sync_token = resp.get('nextSyncToken', sync_token)
+    _stats["full_syncs"] += 1
+    return {"sync_token": sync_token, "events": events, "window_end": window_end}
+
+
+def _delta_sync(service, calendar_id, store):
+    """Zmiany od ostatniego syncToken; None gdy token wygasł (410) i trzeba pełnej synchronizacji."""
+    events = dict(store["events"])
+    sync_token = store["sync_token"]
+    changes = 0
+    try:
+        for resp in _list_pages(service, calendar_id, syncToken=store["sync_token"]):
+            for event in resp.get('items', []):
+                changes += 1
+                if event.get('status') == 'cancelled':
+                    events.pop(event['id'], None)
+                else:
+                    events[event['id']] = _compact(event)
+            sync_token = resp.get('nextSyncToken', sync_token)
+    except HttpError as e:
+        if e.resp.status == 410:
+            return None
+        raise
+    if changes:
+        _stats["delta_syncs"] += 1
+        _stats["delta_changes"] += changes
+    return {"sync_token": sync_token, "events": events, "window_end": store.get("window_end")}
+
+
+def sync_calendar(user_id, calendar_id='primary'):
+    """Jedna synchronizacja kalendarza: delta po syncToken, a gdy się nie da – pełna."""
+    key = (user_id, calendar_id)
+    with _key_lock(key):
+        with _lock:
+            store = _stores.get(key)
+        if store is None:
+            store = _load_store(key)
+
+        now = datetime.now(TZ)
+        service = get_service(user_id, 'calendar')
+        new_store = None
+        if store.get("sync_token") and not _window_expiring(store, now):
+            new_store = _delta_sync(service, calendar_id, store)
+        if new_store is None:
+            new_store = _full_sync(service, calendar_id, now)
+            if not new_store["sync_token"]:
+                # Google nie oddał nextSyncToken (np. nie obsługuje go razem z timeMax) – bez delty
+                # każde odświeżenie to pełna synchronizacja okna (tańsza niż seria bez timeMax)
+                _stats["tokenless_syncs"] += 1
+                if store.get("sync_token") or not store.get("synced_at"):
+                    print(f"[Calendar] Brak nextSyncToken dla user_id={user_id} ({calendar_id}) – "
+                          f"pełna synchronizacja okna przy każdym odświeżeniu")
+        new_store["events"] = _prune(new_store["events"], now, new_store.get("window_end"))
+
+        changed = (new_store["sync_token"] != store.get("sync_token")
+                   or new_store["events"] != store.get("events"))
+        new_store["synced_at"] = time.time()
+        if changed:
+            _save_store(key, new_store)
+        index = _indexes.get(key)
+        if changed or index is None:
+            index = EventIndex(new_store["events"].values())
+        with _lock:
+            _stores[key] = new_store
+            _indexes[key] = index
+    _ensure_sync_thread()
+    return index
+
+
+def _sync_loop():
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        with _lock:
+            keys = list(_stores)
+        for user_id, calendar_id in keys:
+            try:
+                sync_calendar(user_id, calendar_id)
+            except Exception as e:
+                _stats["errors"] += 1
+                print(f"[Calendar] Błąd synchronizacji w tle user_id={user_id} ({calendar_id}): {e}")
+
+
+def _ensure_sync_thread():
+    global _sync_thread
+    with _lock:
+        if _sync_thread and _sync_thread.is_alive():
+            return
+        _sync_thread = threading.Thread(target=_sync_loop, name="calendar_sync", daemon=True)
+        _sync_thread.start()
+
+
+def get_index(user_id, calendar_id='primary'):
+    """Indeks wydarzeń; synchronicznie tylko przy pierwszym użyciu (pusty magazyn)."""
+    key = (user_id, calendar_id)
+    with _lock:
+        index = _indexes.get(key)
+    if index is not None:
+        _ensure_sync_thread()
+        return index
+
+    with _key_lock(key):
+        store = _load_store(key)
+    if not store.get("sync_token"):
+        return sync_calendar(user_id, calendar_id)
+    # magazyn z dysku (np. po restarcie) – od razu do użytku, zmiany dociągnie wątek w tle
+    index = EventIndex(store["events"].values())
+    with _lock:
+        _stores.setdefault(key, store)
+        index = _indexes.setdefault(key, index)
+    _ensure_sync_thread()
+    return index
+
+
+def forget(user_id):
+    """Usuwa lokalne kalendarze użytkownika (np. po unieważnieniu tokenu)."""
+    with _lock:
+        keys = [key for key in _stores if key[0] == user_id]
+    for key in keys:
+        with _key_lock(key):
+            with _lock:
+                _stores.pop(key, None)
+                _indexes.pop(key, None)
+            path = _store_path(*key)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# ---------------- Odczyt (tylko dane lokalne) ----------------
+def get_upcoming_events(user_id=None, calendar_id='primary'):
+    """(today_events, future_events) jak google_calendar.get_upcoming_events, ale z lokalnego indeksu."""
+    index = get_index(user_id, calendar_id)
+    now = datetime.now(TZ)
+    today = now.date()
+    today_events = [event_view(ev, today) for ev in index.today(now)]
+    future_events = [event_view(ev, today) for ev in index.upcoming(now, FUTURE_LIMIT)]
+    return today_events, future_events
+
+
+def stats():
+    with _lock:
+        ages = {f"{u}:{c}": round(time.time() - s.get("synced_at", 0), 1) for (u, c), s in _stores.items()}
+        sizes = {f"{u}:{c}": len(s["events"]) for (u, c), s in _stores.items()}
+        tokenless = [f"{u}:{c}" for (u, c), s in _stores.items() if not s.get("sync_token")]
+    return {**_stats, "age_s": ages, "events": sizes, "tokenless": tokenless}
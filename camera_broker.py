@@ -0,0 +1,314 @@
+# camera_broker.py
+"""
+Wspólna kamera dla wszystkich konsumentów (twarze, gesty, kolejne moduły).
+
+Jeden wątek capture jest właścicielem urządzenia i czyta klatki prosto do
+prealokowanego bufora pierścieniowego (cam.read(bufor) – bez alokacji na klatkę).
+Subskrybent dostaje najnowszą klatkę jako widok tylko do odczytu na slot
+pierścienia – bez kopiowania. Slot jest przypięty do subskrybenta aż do jego
+następnego read()/close(), więc capture nigdy go nie nadpisze (pierścień ma
+co najmniej subskrybenci + 2 sloty, w razie potrzeby rośnie).
+
+Przejście rozpoznawanie twarzy -> gesty to tylko zmiana subskrybenta: kamera
+zostaje otwarta jeszcze CAMERA_IDLE_RELEASE s po odejściu ostatniego
+subskrybenta, więc nie płacimy za zamknięcie/otwarcie V4L2 i rozgrzewkę.
+stats() podaje liczbę otwarć kamery i opóźnienie przejść (od odejścia
+poprzedniego subskrybenta do pierwszej klatki następnego).
+"""
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+CAMERA_RING_SLOTS = int(os.getenv("CAMERA_RING_SLOTS", "4"))
+CAMERA_IDLE_RELEASE = float(os.getenv("CAMERA_IDLE_RELEASE", "30"))   # s bez subskrybentów do zwolnienia kamery
+
+_lock = threading.Lock()
+_brokers = {}   # (camera_index, backend) -> CameraBroker
+
+
+class Subscription:
+    """Uchwyt konsumenta: read() zwraca klatkę nowszą niż poprzednio odebrana."""
+
+    def __init__(self, broker, name):
+        self.broker = broker
+        self.name = name
+        self.closed = False
+        self.frames = 0
+        self._seen = 0          # numer ostatniej odebranej klatki
+        self._pinned = None     # slot trzymany przez subskrybenta
+        self._since = None      # perf_counter odejścia poprzedniego subskrybenta (pomiar przejścia)
+        self._subscribed = time.perf_counter()
+
+    def read(self, timeout=1.0):
+        """
+        Najnowsza klatka (widok tylko do odczytu, ważny do następnego read()/close())
+        albo None po timeout. Konsument, który chce klatkę zatrzymać dłużej, kopiuje ją sam.
+        """
+        return self.broker._read(self, timeout)
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+    @property
+    def active(self):
+        return not self.closed
+
+
+class CameraBroker:
+    def __init__(self, camera_index=0, backend=None, width=640, height=480,
+                 slots=CAMERA_RING_SLOTS, idle_release=CAMERA_IDLE_RELEASE):
+        self.camera_index = camera_index
+        self.backend = cv2.CAP_V4L2 if backend is None else backend  # V4L2 jest stabilniejsze na RPi
+        self.width = width
+        self.height = height
+        self.slots = max(2, slots)
+        self.idle_release = idle_release
+
+        # Odporność na błędy odczytu (jak wcześniej w FaceRecognitionModule)
+        self._READ_SLEEP = 0.02
+        self._REOPEN_AFTER_FAILS = 30
+        self._WARMUP_FRAMES = 5
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._ring = None        # (sloty, h, w, 3) uint8 – alokowany przy pierwszym otwarciu
+        self._views = []         # widoki tylko do odczytu na sloty (wydawane subskrybentom)
+        self._pins = {}          # slot -> liczba subskrybentów, którzy go trzymają
+        self._latest = None      # slot z najnowszą klatką
+        self._seq = 0
+        self._subs = set()
+        self._idle_since = None
+        self._last_close = None  # perf_counter odejścia ostatniego subskrybenta
+        self._reopen = False
+
+        self._stats = {"opens": 0, "open_ms_total": 0.0, "open_ms_last": 0.0, "releases": 0,
+                       "frames": 0, "read_failures": 0, "ring_grows": 0, "subscribes": 0,
+                       "transitions": 0, "transition_ms_total": 0.0, "transition_ms_last": 0.0,
+                       "first_frame_ms_last": 0.0}
+
+    # ---------------- Subskrypcje ----------------
+    def subscribe(self, name):
+        """Nowy subskrybent; pierwszy uruchamia wątek capture (i otwiera kamerę)."""
+        with self._cond:
+            sub = Subscription(self, name)
+            if self._last_close is not None and time.perf_counter() - self._last_close < self.idle_release:
+                sub._since = self._last_close   # przejście między konsumentami (kamera jeszcze otwarta)
+            self._subs.add(sub)
+            self._idle_since = None
+            self._stats["subscribes"] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._capture_loop, name="camera_capture", daemon=True)
+                self._thread.start()
+            return sub
+
+    def _unsubscribe(self, sub):
+        with self._cond:
+            if sub.closed:
+                return
+            sub.closed = True
+            self._unpin(sub)
+            self._subs.discard(sub)
+            self._last_close = time.perf_counter()
+            if not self._subs:
+                self._idle_since = time.monotonic()
+            self._cond.notify_all()
+
+    def _unpin(self, sub):
+        if sub._pinned is not None and self._pins.get(sub._pinned):
+            self._pins[sub._pinned] -= 1
+        sub._pinned = None
+
+    def _read(self, sub, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._unpin(sub)
+            while not sub.closed and (self._latest is None or self._seq <= sub._seen):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if sub.closed:
+                return None
+            slot = self._latest
+            self._pins[slot] = self._pins.get(slot, 0) + 1
+            sub._pinned = slot
+            sub._seen = self._seq
+            if sub.frames == 0:
+                now = time.perf_counter()
+                self._stats["first_frame_ms_last"] = round((now - sub._subscribed) * 1000, 1)
+                if sub._since is not None:
+                    # przejście: poprzedni konsument odszedł -> ten dostał pierwszą klatkę
+                    ms = (now - sub._since) * 1000
+                    self._stats["transitions"] += 1
+                    self._stats["transition_ms_total"] += ms
+                    self._stats["transition_ms_last"] = round(ms, 1)
+            sub.frames += 1
+            return self._views[slot]
+
+    def restart(self):
+        """Miękki restart kamery (np. po zawieszeniu sterownika) – wątek capture otworzy ją ponownie."""
+        with self._cond:
+            self._reopen = True
+
+    # ---------------- Kamera ----------------
+    def _open(self):
+        """Otwarta i rozgrzana kamera albo None."""
+        t0 = time.perf_counter()
+        cam = cv2.VideoCapture(self.camera_index, self.backend)
+        # parametry minimalizujące lag
+        try:
+            cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        except Exception:
+            pass
+        cam.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cam.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if not cam.isOpened():
+            print("[CAM] Nie można otworzyć kamery.")
+            cam.release()
+            return None
+
+        # krótka rozgrzewka – odczytaj kilka klatek (ostatnia ustala rozmiar pierścienia)
+        frame = None
+        for _ in range(self._WARMUP_FRAMES):
+            ok, f = cam.read()
+            if ok and f is not None:
+                frame = f
+            time.sleep(0.02)
+        if frame is not None and (self._ring is None or self._ring.shape[1:] != frame.shape):
+            self._allocate(frame.shape, self.slots)
+
+        ms = (time.perf_counter() - t0) * 1000
+        with self._cond:
+            self._stats["opens"] += 1
+            self._stats["open_ms_total"] += ms
+            self._stats["open_ms_last"] = round(ms, 1)
+        print(f"[CAM] Kamera otwarta ({ms:.0f} ms, otwarcie nr {self._stats['opens']})")
+        return cam
+
+    def _close(self, cam):
+        if cam is None:
+            return
+        try:
+            cam.release()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats["releases"] += 1
+
+    def _allocate(self, shape, slots):
+        """Nowy pierścień; trzymane przez subskrybentów widoki starego zostają ważne (numpy trzyma bufor)."""
+        with self._cond:
+            ring = np.empty((slots,) + tuple(shape), dtype=np.uint8)
+            if self._ring is not None and self._ring.shape[1:] == tuple(shape):
+                ring[:len(self._ring)] = self._ring
+            else:
+                self._pins = {}
+                self._latest = None
+            self._ring = ring
+            self._views = []
+            for slot in ring:
+                view = slot.view()
+                view.flags.writeable = False
+                self._views.append(view)
+
+    def _next_slot(self):
+        """Wolny slot: nie najnowszy i nieprzypięty przez żadnego subskrybenta."""
+        for i in range(1, len(self._ring) + 1):
+            slot = ((self._latest or 0) + i) % len(self._ring)
+            if slot != self._latest and not self._pins.get(slot):
+                return slot
+        return None
+
+    def _capture_loop(self):
+        # kamera jest lokalna dla wątku: wątek kończący się po bezczynności nie zamknie
+        # kamery, którą otworzył już jego następca
+        cam = None
+        fails = 0
+        try:
+            while True:
+                with self._cond:
+                    if not self._subs and self._idle_since is not None \
+                            and time.monotonic() - self._idle_since >= self.idle_release:
+                        self._thread = None   # kolejny subscribe() uruchomi nowy wątek
+                        self._latest = None   # ostatnia klatka jest już nieaktualna
+                        break
+                    reopen, self._reopen = self._reopen, False
+                if reopen:
+                    self._close(cam)
+                    cam = None
+                if cam is None or not cam.isOpened():
+                    cam = self._open()
+                    if cam is None:
+                        time.sleep(0.2)
+                        continue
+                    fails = 0
+
+                with self._cond:
+                    slot = self._next_slot() if self._ring is not None else None
+                if slot is None and self._ring is not None:
+                    # więcej subskrybentów trzyma klatki niż zapasowych slotów – powiększ pierścień
+                    self._allocate(self._ring.shape[1:], len(self._ring) + 1)
+                    with self._cond:
+                        self._stats["ring_grows"] += 1
+                        slot = self._next_slot()
+
+                target = self._ring[slot] if slot is not None else None
+                ok, frame = cam.read(target)
+                if not ok or frame is None:
+                    fails += 1
+                    with self._cond:
+                        self._stats["read_failures"] += 1
+                    # Ogranicz spam logów – informacja co 20 błędów
+                    if fails % 20 == 0:
+                        print("[CAM] read() nie zwrócił klatki, próba ponownego otwarcia…")
+                    if fails >= self._REOPEN_AFTER_FAILS:
+                        self._close(cam)
+                        cam = None
+                    time.sleep(self._READ_SLEEP)
+                    continue
+                fails = 0
+                if frame is not target:
+                    # inny rozmiar klatki niż pierścień (zmiana trybu kamery) – jednorazowa realokacja
+                    self._allocate(frame.shape, len(self._ring) if self._ring is not None else self.slots)
+                    with self._cond:
+                        slot = self._next_slot()
+                    self._ring[slot] = frame
+
+                with self._cond:
+                    self._latest = slot
+                    self._seq += 1
+                    self._stats["frames"] += 1
+                    self._cond.notify_all()
+        finally:
+            self._close(cam)
+            print("[CAM] Kamera zwolniona (brak subskrybentów).")
+
+    def stats(self):
+        with self._cond:
+            st = dict(self._stats)
+            st["subscribers"] = sorted(sub.name for sub in self._subs)
+            st["ring_slots"] = len(self._ring) if self._ring is not None else 0
+            st["capturing"] = bool(self._thread and self._thread.is_alive())
+        st["reopens"] = max(0, st["opens"] - 1)
+        st["transition_ms_avg"] = (round(st["transition_ms_total"] / st["transitions"], 1)
+                                   if st["transitions"] else 0.0)
+        return st
+
+
+def get_broker(camera_index=0, backend=None):
+    """Jeden broker na urządzenie – współdzielony przez wszystkie moduły w procesie."""
+    backend = cv2.CAP_V4L2 if backend is None else backend
+    with _lock:
+        broker = _brokers.get((camera_index, backend))
+        if broker is None:
+            broker = CameraBroker(camera_index, backend)
+            _brokers[(camera_index, backend)] = broker
+        return broker
+
+
+def stats():
+    with _lock:
+        brokers = dict(_brokers)
+    return {str(index): broker.stats() for (index, _backend), broker in brokers.items()}
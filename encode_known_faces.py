@@ -1,15 +1,135 @@
 import sys
 import os
 import shutil
-from face_recognition_module import encode_face_image, save_face_data
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import face_store
+from face_recognition_module import encode_face_image, save_face_data, write_gallery, load_gallery
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+CACHE_PATH = os.path.join("known_faces", "encoding_cache.json")   # sha1 treści zdjęcia -> encoding / null
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_cache():
+    if not os.path.exists(CACHE_PATH):
+        return {}
+    try:
+        with open(CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Uszkodzony cache encodingów {CACHE_PATH}, liczę od nowa: {e}")
+        return {}
+
+
+def _save_cache(cache):
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    tmp = CACHE_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, separators=(',', ':'))
+    os.replace(tmp, CACHE_PATH)
+
+
+def _encode_job(image_path):
+    encoding = encode_face_image(image_path)
+    return None if encoding is None else encoding.tolist()
+
+
+def _in_gallery(encoding, gallery, tol=1e-6):
+    """Czy ten sam encoding (to samo zdjęcie) jest już w galerii."""
+    return bool(np.any(np.all(np.abs(np.asarray(gallery) - np.asarray(encoding)) <= tol, axis=1)))
+
+
+def enroll_batch(root_dir, workers=None, append=False):
+    """
+    Wsadowe dodawanie użytkowników z katalogu <root_dir>/<user>/<zdjęcia>:
+    zdjęcia kodowane równolegle (procesy), już znane treści (hash) brane z cache,
+    galerie zapisywane per użytkownik, a magazyn encodingów przebudowany raz na końcu.
+    append=True dopisuje nowe zdjęcia do istniejących galerii zamiast je zastępować.
+    """
+    t0 = time.perf_counter()
+    cache = _load_cache()
+    images = {}   # user -> [(ścieżka, hash)]
+    for user_name in sorted(os.listdir(root_dir)):
+        user_dir = os.path.join(root_dir, user_name)
+        if not os.path.isdir(user_dir):
+            continue
+        for name in sorted(os.listdir(user_dir)):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                path = os.path.join(user_dir, name)
+                images.setdefault(user_name, []).append((path, _file_hash(path)))
+
+    todo = {}
+    for entries in images.values():
+        for path, digest in entries:
+            if digest not in cache and digest not in todo:
+                todo[digest] = path
+    total = sum(len(entries) for entries in images.values())
+    cached = sum(1 for entries in images.values() for _path, digest in entries if digest in cache)
+    print(f"Zdjęć: {total} ({len(images)} użytkowników), z cache: {cached}, do zakodowania: {len(todo)}")
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            digests = list(todo)
+            for digest, encoding in zip(digests, pool.map(_encode_job, [todo[d] for d in digests])):
+                cache[digest] = encoding
+        _save_cache(cache)
+
+    for user_name, entries in images.items():
+        with_face = [(path, digest) for path, digest in entries if cache.get(digest) is not None]
+        encodings = [cache[digest] for _path, digest in with_face]
+        if append:
+            existing = load_gallery(os.path.join("known_faces", user_name))
+            if existing is not None:
+                # dopisujemy tylko encodingi, których galeria jeszcze nie ma – także te z cache
+                # (np. po przerwanym przebiegu albo nadpisaniu galerii pojedynczym zdjęciem)
+                new = []
+                for enc in encodings:
+                    if not _in_gallery(enc, existing) and not (new and _in_gallery(enc, new)):
+                        new.append(enc)
+                encodings = list(existing) + new
+        if not encodings:
+            print(f"{user_name}: brak twarzy na żadnym zdjęciu – pomijam")
+            continue
+        target_dir = write_gallery(user_name, np.asarray(encodings, dtype=np.float64))
+        for path, _digest in with_face:
+            dst = os.path.join(target_dir, os.path.basename(path))
+            if os.path.abspath(path) != os.path.abspath(dst):
+                shutil.copyfile(path, dst)
+        skipped = len(entries) - len(with_face)
+        print(f"{user_name}: próbek w galerii {len(encodings)}"
+              + (f", bez twarzy: {skipped}" if skipped else ""))
+
+    face_store.build_store("known_faces")
+    print(f"Gotowe w {time.perf_counter() - t0:.1f} s")
+
 
 def main():
-    if len(sys.argv) != 3:
-        print("Użycie: python encode_known_faces.py <user_name> <path_to_image>")
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    append = "--append" in sys.argv
+    if "--batch" in sys.argv:
+        if len(args) not in (1, 2):
+            print("Użycie: python encode_known_faces.py --batch <katalog> [liczba_procesów] [--append]")
+            sys.exit(1)
+        enroll_batch(args[0], workers=int(args[1]) if len(args) == 2 else None, append=append)
+        return
+
+    if len(args) != 2:
+        print("Użycie: python encode_known_faces.py <user_name> <path_to_image> [--append]")
         sys.exit(1)
 
-    user_name = sys.argv[1]
-    image_path = sys.argv[2]
+    user_name = args[0]
+    image_path = args[1]
 
     if not os.path.isfile(image_path):
         print(f"Plik {image_path} nie istnieje.")
@@ -20,11 +140,15 @@ def main():
         print("Nie wykryto twarzy na zdjęciu, kodowanie przerwane.")
         sys.exit(1)
 
-    save_face_data(user_name, image_path, encoding)
-    print(f"Encoding zapisany dla użytkownika '{user_name}' w known_faces/{user_name}/encoding.npy")
+    samples = save_face_data(user_name, image_path, encoding, append=append)
+    print(f"Encoding zapisany dla użytkownika '{user_name}' w known_faces/{user_name}/ "
+          f"(próbek w galerii: {samples})")
 
 if __name__ == "__main__":
     main()
 
 # w terminalu:
 # python encode_known_faces.py szymon known_faces/szymon/szymon.jpg
+# python encode_known_faces.py szymon zdjecia/szymon_okulary.jpg --append   # kolejna próbka do galerii
+# python encode_known_faces.py --batch zdjecia/          # zdjecia/<user>/*.jpg, wszystkie rdzenie
+# python encode_known_faces.py --batch zdjecia/ 3 --append
@@ -0,0 +1,214 @@
+# face_matcher.py
+"""
+Dopasowanie wykrytych twarzy do znanych użytkowników jednym działaniem macierzowym.
+
+Wszystkie znane encodingi siedzą w jednej ciągłej macierzy float32 (N x 128),
+a odległości wszystkich wykrytych twarzy do wszystkich wierszy liczymy naraz:
+|a - b|^2 = |a|^2 + |b|^2 - 2 a·b  (jedno mnożenie macierzy zamiast pętli).
+Wiersze są pogrupowane po user_id, więc dla każdego użytkownika bierzemy
+najbliższy wiersz, a margines to odstęp do drugiego najbliższego użytkownika.
+
+Przy dużych galeriach (wiele próbek na osobę) przeszukujemy indeks podzielony
+k-means na listy (IVF): porównujemy twarz z centroidami i liczymy dokładne
+odległości tylko w IVF_PROBE najbliższych listach – koszt rośnie ~sqrt(N).
+"""
+import sys
+import time
+from collections import namedtuple
+import numpy as np
+
+ENCODING_DIM = 128
+IVF_MIN_ROWS = 2048      # od tylu próbek opłaca się indeks zamiast pełnego przeszukania
+IVF_PROBE = 4            # ile najbliższych list sprawdzamy przy zapytaniu
+KMEANS_ITERATIONS = 10
+
+# user_id – najbliższy użytkownik, distance – odległość, margin – przewaga nad drugim
+# użytkownikiem (inf, gdy jest tylko jeden), matched – distance <= tolerance
+Match = namedtuple("Match", "user_id distance margin matched")
+
+
+def _sq_distances(faces, matrix, sq_norms):
+    sq = (np.einsum("ij,ij->i", faces, faces)[:, None] + sq_norms[None, :]
+          - 2.0 * faces @ matrix.T)
+    return np.maximum(sq, 0.0, out=sq)   # błędy zaokrągleń przy prawie identycznych wektorach
+
+
+class PartitionedIndex:
+    """
+    Indeks IVF: wiersze pogrupowane w ~sqrt(N) list wokół centroidów k-means,
+    przechowywane ciągiem (lista po liście), offsets[k]:offsets[k+1] to lista k.
+    """
+
+    def __init__(self, matrix, row_users, n_lists=None, probe=IVF_PROBE, seed=0):
+        n = matrix.shape[0]
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(n, n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.argmin(_sq_distances(matrix, centroids, np.einsum("ij,ij->i", centroids, centroids)), axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, matrix)
+            counts = np.bincount(assign, minlength=n_lists)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+        order = np.argsort(assign, kind="stable")
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.matrix = np.ascontiguousarray(matrix[order])
+        self._sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.row_users = row_users[order]
+        self.offsets = np.r_[0, np.cumsum(np.bincount(assign, minlength=n_lists))]
+        self.probe = min(probe, n_lists)
+
+    def search(self, face):
+        """(indeksy użytkowników, odległości) kandydatów z najbliższych list."""
+        face = face[None, :]
+        to_centroids = _sq_distances(face, self.centroids, self._centroid_norms)[0]
+        lists = np.argpartition(to_centroids, self.probe - 1)[:self.probe]
+        rows = np.concatenate([np.arange(self.offsets[k], self.offsets[k + 1]) for k in lists])
+        dist = np.sqrt(_sq_distances(face, self.matrix[rows], self._sq_norms[rows])[0])
+        return self.row_users[rows], dist
+
+
+class FaceMatcher:
+    def __init__(self, encodings, ids, tolerance=0.6):
+        """
+        encodings: lista/macierz encodingów (po jednym wierszu na próbkę),
+        ids: user_id dla każdego wiersza (ten sam user może mieć kilka wierszy).
+        """
+        self.tolerance = tolerance
+        ids = np.asarray(ids)
+        if len(ids) == 0:
+            self.matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+            self.user_ids = ids
+            self._starts = np.empty(0, dtype=np.intp)
+            self._sq_norms = np.empty(0, dtype=np.float32)
+            return
+
+        # macierz z magazynu (mmap) bierzemy bez kopiowania, jeśli wiersze użytkownika leżą obok siebie
+        matrix = np.asarray(encodings, dtype=np.float32).reshape(len(ids), -1)
+        # początki grup wierszy jednego użytkownika (dla minimum.reduceat)
+        self._starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        if len(self._starts) != len(np.unique(ids)):
+            order = np.argsort(ids, kind="stable")
+            matrix, ids = matrix[order], ids[order]
+            self._starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        self.matrix = np.ascontiguousarray(matrix)
+        self.user_ids = ids[self._starts]
+        self._sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.index = None
+        if len(ids) >= IVF_MIN_ROWS and len(self.user_ids) > 1:
+            row_users = np.repeat(np.arange(len(self.user_ids)), np.diff(np.r_[self._starts, len(ids)]))
+            self.index = PartitionedIndex(self.matrix, row_users)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def distances(self, face_encodings):
+        """Macierz odległości (twarze x użytkownicy) – najbliższa próbka każdego użytkownika."""
+        faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        sq = _sq_distances(faces, self.matrix, self._sq_norms)
+        per_row = np.sqrt(sq, out=sq)
+        if len(self._starts) == self.matrix.shape[0]:
+            return per_row
+        return np.minimum.reduceat(per_row, self._starts, axis=1)
+
+    def match(self, face_encodings):
+        """Lista Match (po jednej na wykrytą twarz) albo pusta lista, gdy brak znanych."""
+        if len(face_encodings) == 0 or len(self.user_ids) == 0:
+            return []
+        if self.index is not None:
+            faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+            return [self._match_indexed(face) for face in faces]
+        dist = self.distances(face_encodings)
+        best = np.argmin(dist, axis=1)
+        rows = np.arange(len(best))
+        best_dist = dist[rows, best]
+        if dist.shape[1] > 1:
+            second = np.partition(dist, 1, axis=1)[:, 1]
+            margins = second - best_dist
+        else:
+            margins = np.full(len(best), np.inf, dtype=np.float32)
+        return [
+            Match(self.user_ids[b].item(), float(d), float(m), bool(d <= self.tolerance))
+            for b, d, m in zip(best, best_dist, margins)
+        ]
+
+    def _match_indexed(self, face):
+        users, dist = self.index.search(face)
+        order = np.argsort(dist)
+        best = order[0]
+        best_user = users[best]
+        # margines: najbliższa próbka innego użytkownika wśród kandydatów
+        others = order[users[order] != best_user]
+        margin = float(dist[others[0]] - dist[best]) if len(others) else float("inf")
+        d = float(dist[best])
+        return Match(self.user_ids[best_user].item(), d, margin, d <= self.tolerance)
+
+
+# ---------------- Benchmark ----------------
+def benchmark(sizes=(1, 10, 100, 1000), faces=2, rounds=200):
+    """
+    Porównuje dotychczasową ścieżkę (compare_faces + face_distance na liście,
+    osobno dla każdej twarzy) z FaceMatcher dla różnej liczby użytkowników.
+    """
+    import face_recognition
+
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        known = [rng.normal(0, 0.1, ENCODING_DIM) for _ in range(n)]
+        ids = list(range(1, n + 1))
+        detected = [rng.normal(0, 0.1, ENCODING_DIM) for _ in range(faces)]
+
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for face_encoding in detected:
+                matches = face_recognition.compare_faces(known, face_encoding, 0.6)
+                face_distances = face_recognition.face_distance(known, face_encoding)
+                best_index = np.argmin(face_distances)
+                _ = matches[best_index]
+        before = (time.perf_counter() - t0) * 1000 / rounds
+
+        matcher = FaceMatcher(known, ids)
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            matcher.match(detected)
+        after = (time.perf_counter() - t0) * 1000 / rounds
+        print(f"[BENCH] {n:>5} użytkowników, {faces} twarze: "
+              f"pętla {before:.3f} ms -> FaceMatcher {after:.3f} ms na klatkę")
+
+
+def benchmark_galleries(users=100, samples=(1, 10, 50, 200), faces=2, rounds=50):
+    """Czas zapytania przy rosnących galeriach: pełne przeszukanie vs indeks IVF."""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(0, 0.1, (users, ENCODING_DIM))
+    for per_user in samples:
+        encodings = np.repeat(centers, per_user, axis=0) + rng.normal(0, 0.02, (users * per_user, ENCODING_DIM))
+        ids = np.repeat(np.arange(1, users + 1), per_user)
+        detected = centers[:faces] + rng.normal(0, 0.02, (faces, ENCODING_DIM))
+        matcher = FaceMatcher(encodings, ids)
+        index, matcher.index = matcher.index, None
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            exact = matcher.match(detected)
+        full = (time.perf_counter() - t0) * 1000 / rounds
+        line = f"[BENCH] {users} użytkowników x {per_user:>3} próbek: pełne {full:.3f} ms"
+        if index is not None:
+            matcher.index = index
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                approx = matcher.match(detected)
+            ivf = (time.perf_counter() - t0) * 1000 / rounds
+            same = sum(a.user_id == b.user_id for a, b in zip(exact, approx))
+            line += f" -> IVF {ivf:.3f} ms (zgodność {same}/{len(exact)})"
+        print(line)
+
+
+if __name__ == "__main__":
+    # python face_matcher.py [liczba_twarzy]      – FaceMatcher vs pętla face_recognition
+    # python face_matcher.py --galleries          – pełne przeszukanie vs indeks IVF
+    if "--galleries" in sys.argv:
+        benchmark_galleries()
+    else:
+        benchmark(faces=int(sys.argv[1]) if len(sys.argv) > 1 else 2)
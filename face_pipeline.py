@@ -0,0 +1,319 @@
+# face_pipeline.py
+"""
+Potokowe rozpoznawanie twarzy na kilku rdzeniach.
+
+  kamera --(wątek capture)--> LatestFrame --> detekcja (pula procesów, piramida skal)
+         --> tracker (wątek rozpoznawania) --> encoding (pula procesów) --> dopasowanie
+
+Między etapami są ograniczone "kolejki": slot na najnowszą klatkę (starsza,
+nieodebrana klatka jest nadpisywana – liczymy ją jako odrzuconą) oraz limit
+zadań w toku dla detekcji i encodingu. Dzięki temu bufor kamery nie starzeje
+się, gdy dlib liczy, a każdy z rdzeni Pi ma pracę. Tracker, MotionGate
+i FaceMatcher (oraz pamięć ScalePyramid) zostają w wątku rozpoznawania
+(są tanie i stanowe).
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import face_recognition
+
+PIPELINE_WORKERS = int(os.getenv("FACE_PIPELINE_WORKERS", str(max(0, min(3, (os.cpu_count() or 1) - 1)))))
+ENCODE_PAD = 0.5   # zapas wokół twarzy w wycinku do encodingu (chip dlib sięga poza ramkę detekcji)
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_detector = None   # detektor w procesie roboczym (tworzony raz przez initializer)
+
+
+# ---------------- Procesy robocze ----------------
+def _init_worker(detector_name):
+    global _worker_detector
+    cv2.setNumThreads(1)   # równoległość daje pula – OpenCV nie powinien dokładać swoich wątków
+    from face_recognition_module import make_detector
+    _worker_detector = make_detector(detector_name)
+
+
+def _detect(rgb, attempts, min_region):
+    from face_recognition_module import detect_multiscale
+    return detect_multiscale(_worker_detector, rgb, attempts, min_region)
+
+
+def _encode(crops):
+    """crops – [(wycinek, lokalizacja w wycinku)]; jeden encoding na wycinek."""
+    t0 = time.perf_counter()
+    encodings = []
+    for image, location in crops:
+        encodings.extend(face_recognition.face_encodings(image, [location]))
+    return encodings, (time.perf_counter() - t0) * 1000
+
+
+def _ping():
+    return os.getpid()
+
+
+def _crop(rgb, location, pad=ENCODE_PAD):
+    """Wycinek wokół twarzy + jej lokalizacja w wycinku – do procesu nie idzie cała klatka."""
+    h, w = rgb.shape[:2]
+    top, right, bottom, left = location
+    margin = int(max(bottom - top, right - left) * pad)
+    y0, x0 = max(0, top - margin), max(0, left - margin)
+    y1, x1 = min(h, bottom + margin), min(w, right + margin)
+    return rgb[y0:y1, x0:x1], (top - y0, right - x0, bottom - y0, left - x0)
+
+
+def start_pool(detector_name, workers=PIPELINE_WORKERS):
+    """
+    Wspólna pula procesów – start (wczytanie modeli dlib) płacimy raz na proces aplikacji.
+    Wołane przy starcie, zanim powstaną wątki kamery/widżetów: przy metodzie fork
+    pierwsze submit od razu tworzy wszystkie procesy, więc nie dziedziczą zamków
+    trzymanych przez inne wątki. forkserver/spawn odpadają – w każdym procesie
+    roboczym importowałyby ponownie app.py (użytkownicy, pogoda, Google).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None and workers > 0:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                                        initializer=_init_worker, initargs=(detector_name,))
+            _pool.submit(_ping)
+        return _pool
+
+
+def get_pool():
+    """Pula z start_pool() albo None (nie uruchomiona albo porzucona po awarii)."""
+    with _pool_lock:
+        return _pool
+
+
+def discard_pool(broken):
+    """
+    Porzuca zepsutą pulę (np. proces zabity przez OOM). Nowej nie budujemy – fork
+    z działającymi wątkami mógłby zakleszczyć procesy; moduł przechodzi na tryb szeregowy.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------------- Slot na najnowszą klatkę ----------------
+class LatestFrame:
+    """Jednoelementowa kolejka, w której nowa klatka wygrywa ze starą."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1   # poprzednia klatka nie zdążyła trafić do detekcji
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify()
+
+    def take(self, timeout):
+        """(seq, klatka) albo (None, None) po timeout."""
+        with self._cond:
+            if self._frame is None:
+                self._cond.wait(timeout)
+            if self._frame is None:
+                return None, None
+            frame, self._frame = self._frame, None
+            return self._seq, frame
+
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.work_ms = 0.0     # czas pracy w procesie roboczym
+        self.wall_ms = 0.0     # od wysłania do odebrania wyniku (z kolejkowaniem)
+
+    def add(self, work_ms, wall_ms):
+        self.count += 1
+        self.work_ms += work_ms
+        self.wall_ms += wall_ms
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0, "work_ms_avg": 0.0, "latency_ms_avg": 0.0}
+        return {"count": self.count, "work_ms_avg": round(self.work_ms / self.count, 1),
+                "latency_ms_avg": round(self.wall_ms / self.count, 1)}
+
+
+# ---------------- Silnik ----------------
+class PipelinedRecognizer:
+    """
+    Jeden cykl rozpoznawania w trybie potokowym dla FaceRecognitionModule
+    (korzysta z jego kamery, MotionGate, trackera i FaceMatcher).
+    """
+
+    def __init__(self, module, workers=PIPELINE_WORKERS):
+        self.module = module
+        self.workers = workers
+        self.max_detect = workers         # klatek w detekcji naraz
+        self.max_encode = max(1, workers // 2)
+        self.last_stats = {}
+
+    def _worker_failed(self, pool, stage, error, detecting, encoding):
+        """Wyjątek z procesu roboczego: log + licznik; zepsutą pulę porzucamy z zadaniami w toku."""
+        self.module._count("worker_errors")
+        print(f"[FACE] potok: błąd procesu roboczego ({stage}): {error!r}")
+        if not isinstance(error, BrokenProcessPool):
+            return pool
+        for tracks, _sent in encoding.values():
+            for track in tracks:
+                track.encoded_at = None
+        detecting.clear()
+        encoding.clear()
+        discard_pool(pool)
+        print("[FACE] potok: pula procesów padła – dalej tryb szeregowy")
+        self.module.pipeline_workers = 0
+        return None
+
+    def _capture_loop(self, slot, stop):
+        while not stop.is_set():
+            frame = self.module._read_frame()
+            if frame is None:
+                stop.wait(0.02)   # kamera chwilowo niedostępna albo koniec cyklu – bez kręcenia się
+                continue
+            changed, roi = self.module.motion_gate.check(frame)
+            if not changed:
+                self.module._count("frames_static")
+                continue
+            # klatka z brokera jest ważna tylko do następnego odczytu – konwersja tworzy własną kopię
+            slot.put((cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), roi, time.perf_counter()))
+
+    def run(self, callback, t_start):
+        """
+        Zwraca user_id rozpoznanego użytkownika albo None (timeout/stop). Bez puli
+        (albo po jej awarii) ustawia module.pipeline_workers = 0 i oddaje cykl pętli szeregowej.
+        """
+        module = self.module
+        pool = get_pool()
+        if pool is None:
+            print("[FACE] potok: brak puli procesów – tryb szeregowy")
+            module.pipeline_workers = 0
+            return None
+        slot = LatestFrame()
+        stop = threading.Event()
+        capture = threading.Thread(target=self._capture_loop, args=(slot, stop),
+                                   name="face_capture", daemon=True)
+        capture.start()
+
+        detect_stats, encode_stats = _StageStats(), _StageStats()
+        detecting = {}     # future -> (seq, rgb, próby piramidy, wysłano)
+        encoding = {}      # future -> (tracki, wysłano)
+        last_tracked = 0   # numer ostatniej klatki przekazanej trackerowi
+        recognized = None
+        t0 = time.perf_counter()
+
+        try:
+            while pool is not None and module.running and recognized is None \
+                    and (time.time() - t_start) < module.RECOGNITION_TIMEOUT:
+                # 1) nowe klatki do detekcji, jeśli jest miejsce w etapie
+                while len(detecting) < self.max_detect:
+                    seq, item = slot.take(timeout=0.0 if detecting else 0.05)
+                    if item is None:
+                        break
+                    rgb, roi, _captured = item
+                    # skale/obszar z piramidy w chwili wysłania (wyniki klatek w toku jeszcze nie wróciły)
+                    attempts = module._plan_detection(roi)
+                    fut = pool.submit(_detect, rgb, attempts, module.MIN_ROI_SIZE)
+                    detecting[fut] = (seq, rgb, attempts, time.perf_counter())
+
+                pending = list(detecting) + list(encoding)
+                if not pending:
+                    continue
+                done, _ = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+
+                # 2) wyniki detekcji -> tracker -> encoding dla nowych/niepewnych tracków
+                for fut in sorted((f for f in done if f in detecting), key=lambda f: detecting[f][0]):
+                    if fut not in detecting:
+                        continue   # porzucone razem z zepsutą pulą
+                    seq, rgb, attempts, sent = detecting.pop(fut)
+                    try:
+                        locations, scale, tries, work_ms = fut.result()
+                    except Exception as e:
+                        pool = self._worker_failed(pool, "detekcja", e, detecting, encoding)
+                        continue   # klatka przepada, następna przejdzie normalnie
+                    detect_stats.add(work_ms, (time.perf_counter() - sent) * 1000)
+                    if seq < last_tracked:
+                        module._count("frames_hog")
+                        module._count("hog_ms_total", work_ms)
+                        module._count("detect_attempts", tries)
+                        continue   # wynik starszej klatki niż już śledzona – nieaktualny
+                    last_tracked = seq
+                    module._detection_done(locations, scale, tries, work_ms, rgb.shape, attempts)
+                    assigned = module.tracker.update(locations)
+                    module._count("tracks", sum(1 for t, _loc in assigned if t.encoded_at is None))
+                    if not locations or len(module.matcher) == 0:
+                        continue
+                    to_encode = [(t, loc) for t, loc in assigned if module.tracker.needs_encoding(t)]
+                    module._count("encodings_skipped", len(assigned) - len(to_encode))
+                    if not to_encode:
+                        continue
+                    if len(encoding) >= self.max_encode:
+                        module._count("encodings_skipped", len(to_encode))
+                        continue   # etap encodingu pełny – tracker poprosi ponownie przy następnej klatce
+                    for track, _loc in to_encode:
+                        track.encoded_at = module.tracker.frame_no   # w toku – nie zlecaj drugi raz
+                    # do procesu idą tylko wycinki twarzy – pełna klatka była już serializowana do detekcji
+                    enc = pool.submit(_encode, [_crop(rgb, loc) for _t, loc in to_encode])
+                    encoding[enc] = ([t for t, _loc in to_encode], time.perf_counter())
+
+                # 3) encodingi -> dopasowanie -> głosy
+                for fut in [f for f in done if f in encoding]:
+                    if fut not in encoding:
+                        continue   # porzucone razem z zepsutą pulą
+                    tracks, sent = encoding.pop(fut)
+                    try:
+                        encodings, work_ms = fut.result()
+                    except Exception as e:
+                        pool = self._worker_failed(pool, "encoding", e, detecting, encoding)
+                        for track in tracks:
+                            track.encoded_at = None   # tracker zleci encoding ponownie
+                        continue
+                    encode_stats.add(work_ms, (time.perf_counter() - sent) * 1000)
+                    module._count("encodings", len(encodings))
+                    for track, match in zip(tracks, module.matcher.match(encodings)):
+                        module.tracker.add_match(track, match)
+                    for track in sorted(module.tracker.tracks, key=lambda t: -t.best()[1]):
+                        user_id = module.tracker.confirmed(track)
+                        if user_id is not None:
+                            recognized = user_id
+                            print(f"✅ Rozpoznano użytkownika: {user_id} "
+                                  f"(track {track.track_id}, głosy {track.votes}, encodingi {track.encodings})")
+                            break
+        finally:
+            stop.set()
+            capture.join(timeout=1.0)
+            for fut in list(detecting) + list(encoding):
+                fut.cancel()
+
+        elapsed = time.perf_counter() - t0
+        self.last_stats = {
+            "workers": self.workers,
+            "elapsed_s": round(elapsed, 2),
+            "throughput_fps": round(detect_stats.count / elapsed, 1) if elapsed > 0 else 0.0,
+            "frames_dropped": slot.dropped,
+            "detect": detect_stats.summary(),
+            "encode": encode_stats.summary(),
+        }
+        st = self.last_stats
+        print(f"[FACE] potok: {st['throughput_fps']} kl./s, odrzucone {st['frames_dropped']}, "
+              f"detekcja {st['detect']['work_ms_avg']} ms (opóźnienie {st['detect']['latency_ms_avg']} ms), "
+              f"encoding {st['encode']['work_ms_avg']} ms (opóźnienie {st['encode']['latency_ms_avg']} ms)")
+
+        if recognized is not None:
+            try:
+                callback(recognized)
+            except Exception:
+                pass
+        return recognized
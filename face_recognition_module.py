@@ -5,6 +5,11 @@ import numpy as np
 import face_recognition
 import time
 import threading
+from face_matcher import FaceMatcher
+from face_pipeline import PipelinedRecognizer, PIPELINE_WORKERS, start_pool
+import face_store
+import camera_broker
+from face_store import load_gallery, GALLERY_FILE, LEGACY_FILE
 
 def encode_face_image(image_path):
     """
@@ -19,15 +24,31 @@ def encode_face_image(image_path):
         print(f"Nie wykryto twarzy na obrazku {image_path}")
         return None
 
-def save_face_data(user_name, image_path, encoding):
+def write_gallery(user_name, gallery, base_dir="known_faces"):
+    """Atomowo zapisuje galerię użytkownika (M x 128); encoding.npy = pierwsza próbka (stary format)."""
+    target_dir = os.path.join(base_dir, user_name)
+    os.makedirs(target_dir, exist_ok=True)
+    gallery = np.atleast_2d(gallery)
+    tmp_path = os.path.join(target_dir, GALLERY_FILE + ".tmp.npy")
+    np.save(tmp_path, gallery)
+    os.replace(tmp_path, os.path.join(target_dir, GALLERY_FILE))
+    np.save(os.path.join(target_dir, LEGACY_FILE), gallery[0])
+    return target_dir
+
+
+def save_face_data(user_name, image_path, encoding, append=False, rebuild_store=True):
     """
-    Zapisuje encoding i kopiuje obraz do folderu known_faces/user_name/
+    Zapisuje encoding i kopiuje obraz do folderu known_faces/user_name/.
+    append=True dopisuje próbkę do galerii (inne ujęcie, oświetlenie, okulary),
+    domyślnie galeria jest zastępowana tą jedną próbką.
     """
     target_dir = os.path.join("known_faces", user_name)
-    os.makedirs(target_dir, exist_ok=True)
-
-    encoding_path = os.path.join(target_dir, "encoding.npy")
-    np.save(encoding_path, encoding)
+    gallery = load_gallery(target_dir) if append else None
+    if gallery is None:
+        gallery = np.atleast_2d(encoding)
+    else:
+        gallery = np.vstack([gallery, encoding])
+    write_gallery(user_name, gallery)
 
     image_dst = os.path.join(target_dir, os.path.basename(image_path))
     # kopiuj plik tylko jeśli różne ścieżki
@@ -36,22 +57,446 @@ def save_face_data(user_name, image_path, encoding):
     else:
         print(f"Plik {image_path} już znajduje się w docelowym folderze, kopiowanie pominięte.")
 
+    if rebuild_store:
+        # spakowany magazyn musi odpowiadać galeriom – działająca aplikacja podchwyci nową wersję
+        face_store.build_store("known_faces")
+    return len(gallery)
+
 def load_known_encodings(base_dir="known_faces"):
     """
-    Wczytuje wszystkie encodings z podfolderów base_dir.
-    Zwraca dict: {user_name: encoding}
+    Galerie encodingów wszystkich użytkowników ze spakowanego magazynu.
+    Zwraca dict: {user_name: macierz M x 128 (widok tylko do odczytu)}
     """
-    known_encodings = {}
-    if not os.path.exists(base_dir):
-        return known_encodings
+    store = face_store.get_store(base_dir)
+    return {name: store.gallery(name) for name in store.users}
 
-    for user_name in os.listdir(base_dir):
-        user_folder = os.path.join(base_dir, user_name)
-        encoding_path = os.path.join(user_folder, "encoding.npy")
-        if os.path.isfile(encoding_path):
-            encoding = np.load(encoding_path)
-            known_encodings[user_name] = encoding
-    return known_encodings
+
+class MotionGate:
+    """
+    Tani detektor zmian sceny: różnica dwóch kolejnych klatek w skali szarości,
+    zmniejszonych do `width` px. Statyczna scena = HOG pomijamy; przy ruchu
+    zwraca prostokąt zmian (ROI, współrzędne pełnej klatki), do którego można
+    zawęzić detekcję. Co `force_every` s przepuszcza pełną klatkę, żeby nie
+    przegapić osoby, która stanęła przed lustrem i się nie rusza.
+    """
+
+    def __init__(self, width=160, threshold=25, min_area=0.002, pad=0.3,
+                 max_roi_area=0.6, force_every=1.0):
+        self.width = width
+        self.threshold = threshold        # różnica jasności (0–255) uznawana za zmianę
+        self.min_area = min_area          # ułamek zmienionych pikseli uznawany za ruch
+        self.pad = pad                    # poszerzenie ROI (twarz wystaje poza ruchomy fragment)
+        self.max_roi_area = max_roi_area  # większy ROI = i tak liczymy całą klatkę
+        self.force_every = force_every
+        self.reset()
+
+    def reset(self):
+        self._prev = None
+        self._last_full = 0.0
+
+    def check(self, frame):
+        """(czy_wykrywać, roi) – roi to (x0, y0, x1, y1) w pikselach klatki albo None (cała klatka)."""
+        h, w = frame.shape[:2]
+        scale = self.width / float(w)
+        small = cv2.resize(frame, (self.width, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        prev, self._prev = self._prev, gray
+        now = time.time()
+        if prev is None:
+            self._last_full = now
+            return True, None
+
+        diff = cv2.absdiff(gray, prev)
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        changed = cv2.countNonZero(mask)
+        if changed < self.min_area * mask.size:
+            if now - self._last_full >= self.force_every:
+                self._last_full = now
+                return True, None
+            return False, None
+
+        x, y, bw, bh = cv2.boundingRect(mask)
+        if bw * bh > self.max_roi_area * mask.size:
+            self._last_full = now
+            return True, None
+        px, py = int(bw * self.pad), int(bh * self.pad)
+        x0, y0 = max(0, x - px), max(0, y - py)
+        x1, y1 = min(mask.shape[1], x + bw + px), min(mask.shape[0], y + bh + py)
+        return True, (int(x0 / scale), int(y0 / scale), int(x1 / scale), int(y1 / scale))
+
+
+# ---------------- Detektory twarzy ----------------
+# Wszystkie przyjmują obraz RGB i zwracają prostokąty w formacie face_recognition:
+# (top, right, bottom, left), więc dalej (encoding, tracker) nic się nie zmienia.
+MODELS_DIR = os.getenv("FACE_MODELS_DIR", "models")
+
+
+class FaceDetector:
+    name = "base"
+
+    def detect(self, rgb):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<FaceDetector {self.name}>"
+
+
+class HogDetector(FaceDetector):
+    """dlib HOG (dotychczasowa ścieżka) – dokładny, ale najdroższy na CPU Pi."""
+    name = "hog"
+
+    def __init__(self, upsample=1):
+        self.upsample = upsample
+
+    def detect(self, rgb):
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample, model="hog")
+
+
+class CascadeDetector(FaceDetector):
+    """Kaskada OpenCV (Haar albo LBP) – bardzo szybka, więcej fałszywych/pominiętych twarzy."""
+
+    def __init__(self, kind="haar", path=None, scale_factor=1.1, min_neighbors=5, min_size=40):
+        if path is None:
+            if kind == "haar":
+                path = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+            else:
+                # pakiety pip OpenCV nie zawierają kaskad LBP – plik z repozytorium opencv/data
+                path = os.path.join(MODELS_DIR, "lbpcascade_frontalface_improved.xml")
+        self.name = kind
+        self.classifier = cv2.CascadeClassifier(path)
+        if self.classifier.empty():
+            raise RuntimeError(f"Nie można wczytać kaskady {path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = (min_size, min_size)
+
+    def detect(self, rgb):
+        gray = cv2.equalizeHist(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))
+        boxes = self.classifier.detectMultiScale(
+            gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=self.min_size)
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in boxes]
+
+
+class DnnDetector(FaceDetector):
+    """OpenCV DNN: detektor SSD ResNet-10 300x300 (Caffe)."""
+    name = "dnn"
+
+    def __init__(self, prototxt=None, weights=None, confidence=0.6):
+        prototxt = prototxt or os.path.join(MODELS_DIR, "deploy.prototxt")
+        weights = weights or os.path.join(MODELS_DIR, "res10_300x300_ssd_iter_140000.caffemodel")
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, weights)
+        self.confidence = confidence
+
+    def detect(self, rgb):
+        h, w = rgb.shape[:2]
+        # model trenowany na BGR ze średnimi (104, 177, 123)
+        bgr = cv2.cvtColor(cv2.resize(rgb, (300, 300)), cv2.COLOR_RGB2BGR)
+        blob = cv2.dnn.blobFromImage(bgr, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        boxes = []
+        for det in detections:
+            if det[2] < self.confidence:
+                continue
+            x0, y0 = max(0, int(det[3] * w)), max(0, int(det[4] * h))
+            x1, y1 = min(w, int(det[5] * w)), min(h, int(det[6] * h))
+            if x1 > x0 and y1 > y0:
+                boxes.append((y0, x1, y1, x0))
+        return boxes
+
+
+class YuNetDetector(FaceDetector):
+    """OpenCV FaceDetectorYN (YuNet, ONNX) – mały CNN, dobry kompromis na CPU."""
+    name = "yunet"
+
+    def __init__(self, model=None, score_threshold=0.7):
+        model = model or os.path.join(MODELS_DIR, "face_detection_yunet_2023mar.onnx")
+        if not os.path.isfile(model):
+            raise RuntimeError(f"Brak modelu YuNet: {model}")
+        self.detector = cv2.FaceDetectorYN.create(model, "", (320, 320), score_threshold)
+        self._size = None
+
+    def detect(self, rgb):
+        h, w = rgb.shape[:2]
+        if self._size != (w, h):
+            self.detector.setInputSize((w, h))
+            self._size = (w, h)
+        _, faces = self.detector.detect(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+        if faces is None:
+            return []
+        boxes = []
+        for face in faces:
+            x, y, bw, bh = (int(v) for v in face[:4])
+            x0, y0 = max(0, x), max(0, y)
+            boxes.append((y0, min(w, x + bw), min(h, y + bh), x0))
+        return boxes
+
+
+DETECTORS = {
+    "hog": HogDetector,
+    "haar": lambda: CascadeDetector("haar"),
+    "lbp": lambda: CascadeDetector("lbp"),
+    "dnn": DnnDetector,
+    "yunet": YuNetDetector,
+}
+
+
+def make_detector(name=None):
+    """Detektor z konfiguracji (FACE_DETECTOR, domyślnie hog); przy braku modelu – HOG."""
+    name = (name or os.getenv("FACE_DETECTOR", "hog")).lower()
+    factory = DETECTORS.get(name)
+    if factory is None:
+        print(f"[FACE] Nieznany detektor '{name}', używam hog. Dostępne: {', '.join(DETECTORS)}")
+        return HogDetector()
+    try:
+        return factory()
+    except Exception as e:
+        print(f"[FACE] Nie udało się utworzyć detektora '{name}' ({e}), używam hog.")
+        return HogDetector()
+
+
+# ---------------- Piramida skal detekcji ----------------
+PYRAMID_SCALES = tuple(float(s) for s in os.getenv("FACE_PYRAMID_SCALES", "0.25,0.5,1.0").split(","))
+
+
+def _clamp_region(region, min_size, w, h):
+    """Obszar (x0, y0, x1, y1) przycięty do klatki i poszerzony do min_size (detektor potrzebuje zapasu)."""
+    x0, y0, x1, y1 = region
+    if x1 - x0 < min_size:
+        cx = (x0 + x1) // 2
+        x0, x1 = cx - min_size // 2, cx + min_size // 2
+    if y1 - y0 < min_size:
+        cy = (y0 + y1) // 2
+        y0, y1 = cy - min_size // 2, cy + min_size // 2
+    return max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+
+
+def detect_multiscale(detector, rgb, attempts, min_region=160):
+    """
+    Kolejne próby detekcji [(skala, obszar)] aż do pierwszego trafienia.
+    rgb to pełna klatka, obszar (x0, y0, x1, y1) w jej pikselach albo None (cała).
+    Zwraca (lokalizacje w pikselach pełnej klatki, skala trafienia albo None,
+    liczba prób, koszt ms).
+    """
+    h, w = rgb.shape[:2]
+    t0 = time.perf_counter()
+    for tries, (scale, region) in enumerate(attempts, 1):
+        x0 = y0 = 0
+        image = rgb
+        if region is not None:
+            x0, y0, x1, y1 = _clamp_region(region, min_region, w, h)
+            image = rgb[y0:y1, x0:x1]
+        if scale != 1.0:
+            image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        locations = detector.detect(image)
+        if locations:
+            return ([(int(t / scale) + y0, int(r / scale) + x0, int(b / scale) + y0, int(l / scale) + x0)
+                     for t, r, b, l in locations],
+                    scale, tries, (time.perf_counter() - t0) * 1000)
+    return [], None, len(attempts), (time.perf_counter() - t0) * 1000
+
+
+class ScalePyramid:
+    """
+    Adaptacyjny wybór skali detekcji: najpierw najtańsza skala, większa tylko
+    wtedy, gdy nic nie znaleziono. Pamięta skalę i obszar ostatniego trafienia –
+    następna klatka zaczyna od wycinka wokół twarzy; po trafieniu schodzi do
+    najmniejszej skali, w której twarz nadal ma min_face px.
+
+    Najdroższa skala (pełna rozdzielczość) nie jest próbowana na każdej klatce
+    z ruchem bez twarzy: tylko przy niedawnym trafieniu w tej skali, przy małym
+    ROI (tani wycinek) albo co escalate_every-tą chybioną klatkę. W pozostałych
+    klatkach piramida kończy się na ostatniej skali, która znalazła twarz.
+    """
+
+    def __init__(self, scales=PYRAMID_SCALES, min_face=40, region_pad=0.5, forget_after=10,
+                 escalate_every=5, small_roi=320 * 320):
+        self.scales = tuple(sorted(scales))
+        self.min_face = min_face          # px po przeskalowaniu (okno HOG 80 px przy upsample=1)
+        self.region_pad = region_pad      # poszerzenie obszaru twarzy (ruch między klatkami)
+        self.forget_after = forget_after  # po tylu klatkach bez twarzy wracamy do najtańszej skali
+        self.escalate_every = escalate_every  # co którą chybioną klatkę wolno sięgnąć po pełną skalę
+        self.small_roi = small_roi        # px² – ROI tak mały, że pełna skala jest tania
+        self.capped = 0                   # klatki, w których pominięto pełną skalę (od startu)
+        self.reset()
+
+    def reset(self):
+        self.last_scale = None
+        self.last_region = None
+        self._misses = 0
+        self._floor = None        # (skala, rozmiar twarzy) – mniejsze skale tę twarz przegapiły
+        self._hit_scale = None    # skala ostatniego trafienia (przed zejściem w dół)
+        self._hit_age = 0         # klatki od tego trafienia
+        self._uncapped_in = self.escalate_every
+
+    def _ceiling(self, roi):
+        """Największa skala dozwolona w tej klatce."""
+        top = self.scales[-1]
+        if len(self.scales) == 1:
+            return top
+        if self._hit_scale == top and self._hit_age < self.forget_after:
+            return top
+        if roi is not None and (roi[2] - roi[0]) * (roi[3] - roi[1]) <= self.small_roi:
+            return top
+        self._uncapped_in -= 1
+        if self._uncapped_in <= 0:
+            self._uncapped_in = self.escalate_every
+            return top
+        self.capped += 1
+        return max(self.scales[-2], self._hit_scale or 0.0)
+
+    def plan(self, roi=None):
+        """Lista prób [(skala, obszar)] dla detect_multiscale; roi z MotionGate albo None."""
+        start = self.scales[0] if self.last_scale is None else self.last_scale
+        attempts = [(start, self.last_region)] if self.last_region is not None else []
+        ceiling = max(start, self._ceiling(roi))
+        return attempts + [(s, roi) for s in self.scales if start <= s <= ceiling]
+
+    def update(self, locations, scale, frame_shape, missed=()):
+        """
+        Wynik detekcji (lokalizacje w pikselach pełnej klatki) – zapamiętaj skalę i obszar.
+        missed – skale prób, które w tej klatce nic nie znalazły przed trafieniem.
+        """
+        self._hit_age += 1
+        if not locations:
+            self.last_region = None
+            self._misses += 1
+            if self._misses >= self.forget_after:
+                self.reset()
+            return
+        self._misses = 0
+        self._hit_scale, self._hit_age = scale, 0
+        h, w = frame_shape[:2]
+        size = min(min(b - t, r - l) for t, r, b, l in locations)
+        if any(s < scale for s in missed):
+            self._floor = (scale, size)
+        elif self._floor is not None and size >= 1.5 * self._floor[1]:
+            self._floor = None    # twarz wyraźnie urosła (podeszła) – mniejsza skala znów ma szansę
+        floor = self._floor[0] if self._floor is not None else 0.0
+        # schodzimy niżej tylko do skal, których ta twarz jeszcze nie przegapiła
+        fitting = [s for s in self.scales if size * s >= self.min_face and floor <= s <= scale]
+        self.last_scale = fitting[0] if fitting else scale
+        top = min(t for t, _r, _b, _l in locations)
+        right = max(r for _t, r, _b, _l in locations)
+        bottom = max(b for _t, _r, b, _l in locations)
+        left = min(l for _t, _r, _b, l in locations)
+        pad = int(max(bottom - top, right - left) * self.region_pad)
+        self.last_region = (max(0, left - pad), max(0, top - pad), min(w, right + pad), min(h, bottom + pad))
+
+
+def _iou(a, b):
+    """IoU dwóch prostokątów w formacie face_recognition (top, right, bottom, left)."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class FaceTrack:
+    """Jedna osoba śledzona między klatkami: ostatnia pozycja + głosy dopasowań."""
+
+    def __init__(self, track_id, location, frame_no):
+        self.track_id = track_id
+        self.location = location
+        self.last_seen = frame_no
+        self.encoded_at = None      # numer klatki ostatniego encodingu
+        self.votes = {}             # user_id -> liczba dopasowań
+        self.encodings = 0
+        self.strong = False         # było pojedyncze pewne dopasowanie
+
+    def best(self):
+        """(user_id, głosy) z największą liczbą głosów albo (None, 0)."""
+        if not self.votes:
+            return None, 0
+        user_id = max(self.votes, key=self.votes.get)
+        return user_id, self.votes[user_id]
+
+
+class FaceTracker:
+    """
+    Lekki tracker: wykrycia z kolejnych klatek łączymy z trackami po IoU
+    (zachłannie, od największego nakładania). Encoding (najdroższy krok)
+    liczymy tylko dla nowych tracków i tych bez pewnego wyniku; pewność
+    rośnie z głosami zbieranymi przez kolejne klatki.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=5, votes_needed=2,
+                 confident_distance=0.45, min_margin=0.08, unknown_recheck=5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed                  # klatki bez wykrycia, po których track znika
+        self.votes_needed = votes_needed              # głosy potrzebne przy słabszych dopasowaniach
+        self.confident_distance = confident_distance  # pojedyncze dopasowanie tak bliskie wystarcza…
+        self.min_margin = min_margin                  # …o ile wyraźnie wygrywa z drugim użytkownikiem
+        self.unknown_recheck = unknown_recheck        # co ile klatek ponawiamy encoding nieznanej twarzy
+        self.reset()
+
+    def reset(self):
+        self.tracks = []
+        self.frame_no = 0
+        self._next_id = 1
+
+    def update(self, locations):
+        """Przypisuje wykrycia do tracków (tworząc nowe); zwraca listę (track, lokalizacja)."""
+        self.frame_no += 1
+        pairs = sorted(
+            ((_iou(track.location, loc), ti, li)
+             for ti, track in enumerate(self.tracks) for li, loc in enumerate(locations)),
+            reverse=True,
+        )
+        used_tracks, used_locs, assigned = set(), set(), []
+        for iou, ti, li in pairs:
+            if iou < self.iou_threshold:
+                break
+            if ti in used_tracks or li in used_locs:
+                continue
+            used_tracks.add(ti)
+            used_locs.add(li)
+            assigned.append((self.tracks[ti], locations[li]))
+
+        for li, loc in enumerate(locations):
+            if li not in used_locs:
+                track = FaceTrack(self._next_id, loc, self.frame_no)
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned.append((track, loc))
+
+        for track, loc in assigned:
+            track.location = loc
+            track.last_seen = self.frame_no
+        self.tracks = [t for t in self.tracks if self.frame_no - t.last_seen <= self.max_missed]
+        return assigned
+
+    def needs_encoding(self, track):
+        if track.encoded_at is None:
+            return True                       # nowa twarz
+        if self.confirmed(track) is not None:
+            return False
+        if not track.votes:
+            # dotąd nikogo nie przypominała – sprawdzamy rzadziej
+            return self.frame_no - track.encoded_at >= self.unknown_recheck
+        return True                           # niepewne dopasowanie – zbieramy kolejne głosy
+
+    def add_match(self, track, match):
+        track.encoded_at = self.frame_no
+        track.encodings += 1
+        if not match.matched:
+            return
+        track.votes[match.user_id] = track.votes.get(match.user_id, 0) + 1
+        if match.distance <= self.confident_distance and match.margin >= self.min_margin:
+            track.strong = True
+
+    def confirmed(self, track):
+        """user_id, jeśli track jest pewnie rozpoznany, inaczej None."""
+        user_id, votes = track.best()
+        if user_id is None:
+            return None
+        if votes >= self.votes_needed or (track.strong and votes == sum(track.votes.values())):
+            return user_id
+        return None
 
 
 class FaceRecognitionModule:
@@ -64,7 +509,7 @@ class FaceRecognitionModule:
     - stop_recognition() prawidłowo uwalnia zasoby.
     """
 
-    def __init__(self, known_users, base_dir="known_faces", camera_index=0, backend=None):
+    def __init__(self, known_users, base_dir="known_faces", camera_index=0, backend=None, detector=None):
         """
         known_users: lista MirrorUser (z user_id i name)
         Ładuje encodings z dysku i tworzy listę do rozpoznawania.
@@ -78,65 +523,72 @@ class FaceRecognitionModule:
         self.RECOGNITION_TIMEOUT = 5.0  # sekundy maks. dla pojedynczego cyklu startu
         self.TOLERANCE = 0.6
 
-        # Kamera / wątek
+        # Kamera (wspólna, camera_broker – urządzeniem zarządza broker) / wątek
         self.camera_index = camera_index
         self.backend = cv2.CAP_V4L2 if backend is None else backend  # V4L2 jest stabilniejsze na RPi
-        self.camera = None
+        self.camera_broker = camera_broker.get_broker(self.camera_index, self.backend)
+        self.camera = None   # subskrypcja brokera na czas cyklu rozpoznawania
         self.running = False
         self.recognition_thread = None
         self.lock = threading.Lock()
         self._callback = None
-
-        # Odporność na błędy odczytu
-        self._fail_reads = 0
-        self._READ_SLEEP = 0.02
-        self._REOPEN_AFTER_FAILS = 30  # po tylu błędnych odczytach zrobimy reopen
-        self._WARMUP_FRAMES = 5
-
-        # Załaduj encodings
-        for user in known_users:
-            user_dir = os.path.join(base_dir, user.name)
-            encoding_path = os.path.join(user_dir, "encoding.npy")
-            if os.path.isfile(encoding_path):
-                encoding = np.load(encoding_path)
-                self.known_encodings.append(encoding)
-                self.known_ids.append(user.user_id)
-            else:
-                print(f"Brak encodingu dla użytkownika {user.name} w {encoding_path}")
-
-    # ---------------- Kamera: otwieranie / zamykanie ----------------
+        self._READ_TIMEOUT = 0.5
+
+        # Detektor twarzy (FACE_DETECTOR: hog | haar | lbp | dnn | yunet)
+        self.detector = detector if isinstance(detector, FaceDetector) else make_detector(detector)
+        print(f"[FACE] Detektor twarzy: {self.detector.name}")
+
+        # Bramkowanie detekcji ruchem + liczniki (ile klatek faktycznie idzie przez HOG)
+        self.motion_gate = MotionGate()
+        self.MIN_ROI_SIZE = 160   # px (pełnej klatki) – mniejszy ROI poszerzamy
+        self._stats_lock = threading.Lock()
+        self._stats = {"frames_captured": 0, "frames_static": 0, "frames_hog": 0,
+                       "frames_hog_roi": 0, "hog_ms_total": 0.0, "detect_attempts": 0,
+                       "encodings": 0, "encodings_skipped": 0, "tracks": 0, "worker_errors": 0}
+
+        # Piramida skal: 0.25 -> 0.5 -> 1.0 tylko gdy tańsza skala nic nie znalazła (1.0 oszczędnie)
+        self.pyramid = ScalePyramid()
+        self._scale_hits = {scale: 0 for scale in self.pyramid.scales}
+
+        # Śledzenie twarzy między klatkami – encoding tylko dla nowych/niepewnych
+        self.tracker = FaceTracker()
+
+        # Tryb potokowy (face_pipeline): liczba procesów roboczych, 0 = pętla szeregowa.
+        # Pulę tworzymy tutaj (moduł powstaje przy starcie app.py), zanim ruszą inne wątki.
+        self.pipeline_workers = PIPELINE_WORKERS
+        self._pipeline_stats = {}
+        if self.pipeline_workers > 0:
+            start_pool(self.detector.name, self.pipeline_workers)
+
+        # Encodingi ze wspólnego magazynu (mmap) – po kilka próbek na użytkownika
+        self._store = None
+        self.matcher = None
+        self._load_encodings()
+
+    def _load_encodings(self):
+        """(Prze)ładowuje encodingi znanych użytkowników z magazynu i buduje FaceMatcher."""
+        store = face_store.get_store(self.base_dir)
+        name_to_id = {user.name: user.user_id for user in self.known_users}
+        for name in name_to_id:
+            if name not in store.users:
+                print(f"Brak encodingu dla użytkownika {name} w magazynie {self.base_dir}")
+        matrix, row_names = store.select(name_to_id)
+        self.known_encodings = matrix
+        self.known_ids = [name_to_id[name] for name in row_names]
+        # wszystkie próbki w jednej macierzy – dopasowanie jednym działaniem (IVF przy dużych galeriach)
+        self.matcher = FaceMatcher(matrix, self.known_ids, self.TOLERANCE)
+        self._store = store
+
+    # ---------------- Kamera: subskrypcja brokera ----------------
     def _open_camera(self):
-        """Otwórz kamerę bezpiecznie; zwróć True/False."""
+        """Subskrybuj wspólną kamerę (broker otwiera urządzenie tylko, gdy nikt go nie trzyma)."""
         self._close_camera()
-
-        cam = cv2.VideoCapture(self.camera_index, self.backend)
-        # parametry minimalizujące lag
-        try:
-            cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        except Exception:
-            pass
-        cam.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-        if not cam.isOpened():
-            print("[CAM] Nie można otworzyć kamery.")
-            return False
-
-        # krótka rozgrzewka – odczytaj kilka klatek
-        for _ in range(self._WARMUP_FRAMES):
-            cam.read()
-            time.sleep(0.02)
-
-        self.camera = cam
-        self._fail_reads = 0
+        self.camera = self.camera_broker.subscribe("face")
         return True
 
     def _close_camera(self):
         if self.camera is not None:
-            try:
-                self.camera.release()
-            except Exception:
-                pass
+            self.camera.close()
         self.camera = None
 
     # ---------------- Sterowanie wątkiem ----------------
@@ -146,9 +598,12 @@ class FaceRecognitionModule:
         """
         with self.lock:
             self._callback = callback
+            if face_store.get_store(self.base_dir) is not self._store:
+                # magazyn przebudowany (nowe próbki) – jedno stat(), przeładowanie tylko po zmianie
+                self._load_encodings()
             if self.recognition_thread and self.recognition_thread.is_alive():
-                # wątek żyje – upewnij się, że kamera jest otwarta
-                if self.camera is None or (not self.camera.isOpened()):
+                # wątek żyje – upewnij się, że subskrypcja kamery jest aktywna
+                if self.camera is None or not self.camera.active:
                     self._open_camera()
                 return
 
@@ -168,15 +623,14 @@ class FaceRecognitionModule:
                 self.running = False  # na wszelki wypadek
                 self.start_recognition_thread(self._callback or (lambda _uid: None))
             else:
-                if self.camera is None or (not self.camera.isOpened()):
+                if self.camera is None or not self.camera.active:
                     self._open_camera()
 
     def restart_recognition(self):
         """
-        Miękki restart kamery w trakcie pracy (np. po serii błędów read()).
+        Miękki restart kamery w trakcie pracy (np. po zawieszeniu sterownika).
         """
-        with self.lock:
-            self._close_camera()  # pętla sama spróbuje otworzyć ponownie
+        self.camera_broker.restart()   # broker otworzy urządzenie ponownie, subskrypcje zostają
 
     def stop_recognition(self):
         with self.lock:
@@ -190,6 +644,63 @@ class FaceRecognitionModule:
         """Alias dla stop_recognition (zachowanie wstecznej kompatybilności)."""
         self.stop_recognition()
 
+    # ---------------- Detekcja ----------------
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def stats(self):
+        """Liczniki od startu: klatki z kamery vs klatki faktycznie przepuszczone przez HOG."""
+        with self._stats_lock:
+            st = dict(self._stats)
+            hits = dict(self._scale_hits)
+        # hog_ms_avg = średni koszt detekcji na klatkę (suma wszystkich prób piramidy)
+        st["hog_ms_avg"] = st["hog_ms_total"] / st["frames_hog"] if st["frames_hog"] else 0.0
+        st["attempts_avg"] = st["detect_attempts"] / st["frames_hog"] if st["frames_hog"] else 0.0
+        st["scale_hits"] = {str(scale): n for scale, n in hits.items()}
+        st["pyramid_capped"] = self.pyramid.capped   # klatki bez próby w pełnej skali
+        st["detector"] = self.detector.name   # frames_hog/hog_ms_* liczą przebiegi tego detektora
+        st["pipeline"] = self._pipeline_stats
+        return st
+
+    def _plan_detection(self, roi):
+        """Próby (skala, obszar) dla bieżącej klatki – z pamięci piramidy i ROI z MotionGate."""
+        attempts = self.pyramid.plan(roi)
+        if attempts[0][1] is not None:
+            self._count("frames_hog_roi")
+        return attempts
+
+    def _detection_done(self, locations, scale, tries, ms, frame_shape, attempts=()):
+        missed = [s for s, _region in attempts[:tries - 1]] if locations else ()
+        self.pyramid.update(locations, scale, frame_shape, missed)
+        with self._stats_lock:
+            self._stats["frames_hog"] += 1
+            self._stats["hog_ms_total"] += ms
+            self._stats["detect_attempts"] += tries
+            if scale is not None:
+                self._scale_hits[scale] += 1
+
+    def _detect_faces(self, rgb, roi):
+        """Detekcja piramidą skal; lokalizacje w pikselach pełnej klatki."""
+        attempts = self._plan_detection(roi)
+        locations, scale, tries, ms = detect_multiscale(self.detector, rgb, attempts, self.MIN_ROI_SIZE)
+        self._detection_done(locations, scale, tries, ms, rgb.shape, attempts)
+        return locations
+
+    def _read_frame(self):
+        """Najnowsza klatka z brokera (widok bez kopii, ważny do następnego odczytu); None, gdy chwilowo brak."""
+        camera = self.camera
+        if camera is None or not camera.active:
+            if not self.running:
+                return None
+            self._open_camera()
+            camera = self.camera
+        frame = camera.read(timeout=self._READ_TIMEOUT)
+        if frame is None:
+            return None
+        self._count("frames_captured")
+        return frame
+
     # ---------------- Pętla rozpoznawania ----------------
     def _recognition_loop(self, callback):
         """
@@ -201,69 +712,104 @@ class FaceRecognitionModule:
         """
         t_start = time.time()
 
-        # Otwórz kamerę; jeśli się nie uda, próbuj aż running=False lub minie timeout
-        while self.running and (time.time() - t_start) < self.RECOGNITION_TIMEOUT:
-            if self._open_camera():
-                break
-            time.sleep(0.2)
+        # Kamera jest wspólna – subskrypcja nie otwiera urządzenia, jeśli już pracuje (np. dla gestów)
+        self._open_camera()
 
         print("🔍 Rozpoczynam rozpoznawanie twarzy...")
 
+        try:
+            if self.pipeline_workers > 0:
+                # capture / detekcja / encoding równolegle na kilku rdzeniach
+                engine = PipelinedRecognizer(self, workers=self.pipeline_workers)
+                if engine.run(callback, t_start) is not None:
+                    with self.lock:
+                        self.running = False
+                self._pipeline_stats = engine.last_stats
+            if self.pipeline_workers == 0 and self.running:
+                # tryb szeregowy – z konfiguracji albo po awarii puli (reszta tego cyklu)
+                self._serial_loop(callback, t_start)
+
+            if self.running:
+                # limit czasu dobiegł końca
+                print("⏱️ Timeout – nie rozpoznano użytkownika.")
+
+            st = self.stats()
+            print(f"[FACE] klatki: {st['frames_captured']}, statyczne: {st['frames_static']}, "
+                  f"HOG: {st['frames_hog']} (w ROI: {st['frames_hog_roi']}), "
+                  f"śr. HOG {st['hog_ms_avg']:.1f} ms/klatkę ({st['attempts_avg']:.2f} prób, "
+                  f"trafienia wg skali {st['scale_hits']}), encodingi: {st['encodings']} "
+                  f"(pominięte dzięki śledzeniu: {st['encodings_skipped']}, błędy procesów: {st['worker_errors']})")
+        except Exception as e:
+            print(f"[FACE] Błąd w pętli rozpoznawania: {e}")
+        finally:
+            # Porządki – także po wyjątku, żeby kolejny cykl startował od czystego stanu
+            # (kamerę zwalnia broker, gdy nikt jej nie subskrybuje)
+            with self.lock:
+                self.running = False
+            self.motion_gate.reset()
+            self.tracker.reset()
+            self.pyramid.reset()
+            self._close_camera()
+
+    def _serial_loop(self, callback, t_start):
+        """Wszystkie etapy po kolei w wątku rozpoznawania (FACE_PIPELINE_WORKERS=0)."""
         while self.running and (time.time() - t_start) < self.RECOGNITION_TIMEOUT:
-            # Jeżeli kamera padła, spróbuj ją otworzyć ponownie
-            if self.camera is None or (not self.camera.isOpened()):
-                if not self._open_camera():
-                    time.sleep(0.1)
-                    continue
-
-            ok, frame = self.camera.read()
-            if not ok or frame is None:
-                self._fail_reads += 1
-                # Ogranicz spam logów – informacja co 20 błędów
-                if (self._fail_reads % 20) == 0:
-                    print("[CAM] read() nie zwrócił klatki, próba ponownego otwarcia…")
-                if self._fail_reads >= self._REOPEN_AFTER_FAILS:
-                    self.restart_recognition()
-                time.sleep(self._READ_SLEEP)
+            frame = self._read_frame()
+            if frame is None:
                 continue
 
-            self._fail_reads = 0
+            # Statyczna scena – nie ma po co liczyć HOG
+            changed, roi = self.motion_gate.check(frame)
+            if not changed:
+                self._count("frames_static")
+                time.sleep(0.01)
+                continue
 
-            # Zmniejsz obraz (opcjonalnie), by zwiększyć wydajność
-            small_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+            # Skalę wybiera piramida (najtańsza, która coś znajduje), encoding liczymy z pełnej klatki
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-            # Wykryj twarze
-            face_locations = face_recognition.face_locations(rgb_small_frame, model="hog")
+            # Wykryj twarze (w obszarze ostatniej twarzy albo zmian, jeśli jest mały)
+            face_locations = self._detect_faces(rgb_frame, roi)
             if not face_locations:
+                self.tracker.update([])   # tracki bez wykryć się starzeją
                 # brak twarzy – nie spamuj logiem w każdej iteracji
                 time.sleep(0.01)
                 continue
 
-            print(f"🧠 Wykryto {len(face_locations)} twarzy.")
+            if len(self.matcher) == 0:
+                # Brak znanych — nie ma z czym porównać
+                time.sleep(0.05)
+                continue
+
+            assigned = self.tracker.update(face_locations)
+            self._count("tracks", sum(1 for track, _loc in assigned if track.encoded_at is None))
+            to_encode = [(track, loc) for track, loc in assigned if self.tracker.needs_encoding(track)]
+            self._count("encodings_skipped", len(assigned) - len(to_encode))
+            if not to_encode:
+                time.sleep(0.01)
+                continue
+
+            print(f"🧠 Wykryto {len(face_locations)} twarzy, encoding dla {len(to_encode)}.")
 
             try:
-                face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+                face_encodings = face_recognition.face_encodings(
+                    rgb_frame, [loc for _track, loc in to_encode])
             except Exception as e:
                 print(f"[!] Błąd podczas wyciągania encodingów: {e}")
                 continue
-
-            if len(self.known_encodings) == 0:
-                # Brak znanych — nie ma z czym porównać
-                time.sleep(0.05)
-                continue
-
-            # Porównaj każdą wykrytą twarz
-            for face_encoding in face_encodings:
-                matches = face_recognition.compare_faces(self.known_encodings, face_encoding, self.TOLERANCE)
-                face_distances = face_recognition.face_distance(self.known_encodings, face_encoding)
-                if len(face_distances) == 0:
-                    continue
-
-                best_index = np.argmin(face_distances)
-                if matches[best_index]:
-                    recognized_user = self.known_ids[best_index]
-                    print(f"✅ Rozpoznano użytkownika: {recognized_user}")
+            self._count("encodings", len(face_encodings))
+
+            # Porównaj wszystkie nowe encodingi naraz i dopisz głosy do tracków
+            matches = self.matcher.match(face_encodings)
+            for (track, _loc), match in zip(to_encode, matches):
+                self.tracker.add_match(track, match)
+
+            # najpierw track z największą liczbą głosów
+            for track in sorted(self.tracker.tracks, key=lambda t: -t.best()[1]):
+                recognized_user = self.tracker.confirmed(track)
+                if recognized_user is not None:
+                    print(f"✅ Rozpoznano użytkownika: {recognized_user} "
+                          f"(track {track.track_id}, głosy {track.votes}, encodingi {track.encodings})")
                     try:
                         callback(recognized_user)
                     except Exception:
@@ -275,9 +821,154 @@ class FaceRecognitionModule:
 
             time.sleep(0.01)  # delikatna drzemka, żeby nie zajechać CPU
 
-        if self.running:
-            # limit czasu dobiegł końca
-            print("⏱️ Timeout – nie rozpoznano użytkownika.")
 
-        # Porządki
-        self._close_camera()
+# ---------------- Benchmark detektorów ----------------
+def _recorded_frames(source):
+    """Klatki BGR z katalogu obrazów (po nazwie) albo z pliku wideo."""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                yield frame
+        return
+    cap = cv2.VideoCapture(source)
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        cap.release()
+
+
+def record_frames(out_dir, count=100, camera_index=0, interval=0.1):
+    """Nagrywa klatki z kamery do out_dir (materiał do benchmarku)."""
+    os.makedirs(out_dir, exist_ok=True)
+    cam = cv2.VideoCapture(camera_index, cv2.CAP_V4L2)
+    cam.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    saved = 0
+    try:
+        while saved < count:
+            ok, frame = cam.read()
+            if ok:
+                cv2.imwrite(os.path.join(out_dir, f"frame_{saved:05d}.jpg"), frame)
+                saved += 1
+            time.sleep(interval)
+    finally:
+        cam.release()
+    print(f"[BENCH] Zapisano {saved} klatek w {out_dir}")
+
+
+def benchmark_detectors(source, names=None, base_dir="known_faces", scale=0.5):
+    """
+    Dla każdego detektora na nagranych klatkach: średni czas detekcji,
+    odsetek klatek z twarzą i czas do rozpoznania (detekcja + encoding +
+    dopasowanie + tracker liczone od pierwszej klatki, jak w pętli rozpoznawania).
+    """
+    frames = [cv2.cvtColor(cv2.resize(f, (0, 0), fx=scale, fy=scale), cv2.COLOR_BGR2RGB)
+              for f in _recorded_frames(source)]
+    if not frames:
+        print(f"[BENCH] Brak klatek w {source}")
+        return
+    store = face_store.get_store(base_dir)
+    user_names = list(store.users)
+    matrix, row_names = store.select(user_names)
+    matcher = FaceMatcher(matrix, [user_names.index(n) for n in row_names])
+
+    for name in names or list(DETECTORS):
+        try:
+            detector = DETECTORS[name]()
+        except Exception as e:
+            print(f"[BENCH] {name}: pominięty ({e})")
+            continue
+        detect_ms = []
+        with_face = 0
+        for rgb in frames:
+            t0 = time.perf_counter()
+            locations = detector.detect(rgb)
+            detect_ms.append((time.perf_counter() - t0) * 1000)
+            with_face += bool(locations)
+
+        # czas do rozpoznania: pełna ścieżka klatka po klatce do pierwszego potwierdzenia
+        tracker = FaceTracker()
+        elapsed = 0.0
+        recognized = None
+        for i, rgb in enumerate(frames):
+            t0 = time.perf_counter()
+            locations = detector.detect(rgb)
+            assigned = tracker.update(locations)
+            to_encode = [(t, loc) for t, loc in assigned if tracker.needs_encoding(t)]
+            if to_encode and len(matcher):
+                encodings = face_recognition.face_encodings(rgb, [loc for _t, loc in to_encode])
+                for (track, _loc), match in zip(to_encode, matcher.match(encodings)):
+                    tracker.add_match(track, match)
+                for track in tracker.tracks:
+                    user = tracker.confirmed(track)
+                    if user is not None:
+                        recognized = (user_names[user], i)
+                        break
+            elapsed += (time.perf_counter() - t0) * 1000
+            if recognized:
+                break
+
+        ttr = (f"{elapsed:.0f} ms ({recognized[0]}, klatka {recognized[1] + 1})"
+               if recognized else "brak rozpoznania")
+        print(f"[BENCH] {name:>5}: detekcja śr. {np.mean(detect_ms):6.1f} ms "
+              f"(p95 {np.percentile(detect_ms, 95):6.1f} ms), "
+              f"twarz na {with_face}/{len(frames)} klatek, czas do rozpoznania: {ttr}")
+
+
+def benchmark_pyramid(source, name=None, fixed_scale=0.5):
+    """
+    Średni koszt detekcji na klatkę: dotychczasowa stała skala (resize fx=0.5 + detekcja)
+    vs ScalePyramid (klatki po kolei, z pamięcią skali i obszaru twarzy).
+    """
+    frames = [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in _recorded_frames(source)]
+    if not frames:
+        print(f"[BENCH] Brak klatek w {source}")
+        return
+    detector = make_detector(name)
+
+    fixed_ms, fixed_found = [], 0
+    for rgb in frames:
+        locations, _scale, _tries, ms = detect_multiscale(detector, rgb, [(fixed_scale, None)])
+        fixed_ms.append(ms)
+        fixed_found += bool(locations)
+
+    pyramid = ScalePyramid()
+    pyramid_ms, pyramid_found, tries_total = [], 0, 0
+    hits = {scale: 0 for scale in pyramid.scales}
+    for rgb in frames:
+        attempts = pyramid.plan()
+        locations, scale, tries, ms = detect_multiscale(detector, rgb, attempts)
+        pyramid.update(locations, scale, rgb.shape, [s for s, _r in attempts[:tries - 1]])
+        pyramid_ms.append(ms)
+        pyramid_found += bool(locations)
+        tries_total += tries
+        if scale is not None:
+            hits[scale] += 1
+
+    print(f"[BENCH] {detector.name}, {len(frames)} klatek")
+    print(f"[BENCH] stała skala {fixed_scale}: śr. {np.mean(fixed_ms):6.1f} ms/klatkę "
+          f"(p95 {np.percentile(fixed_ms, 95):6.1f} ms), twarz na {fixed_found} klatkach")
+    print(f"[BENCH] piramida {pyramid.scales}: śr. {np.mean(pyramid_ms):6.1f} ms/klatkę "
+          f"(p95 {np.percentile(pyramid_ms, 95):6.1f} ms), twarz na {pyramid_found} klatkach, "
+          f"śr. {tries_total / len(frames):.2f} prób, trafienia wg skali {hits}")
+
+
+if __name__ == "__main__":
+    import sys
+    # python face_recognition_module.py --record klatki/ 100     – nagraj klatki z kamery
+    # python face_recognition_module.py --bench klatki/ [hog,haar,lbp,dnn,yunet]
+    # python face_recognition_module.py --pyramid klatki/ [detektor]   – stała skala 0.5 vs piramida
+    if len(sys.argv) >= 3 and sys.argv[1] == "--record":
+        record_frames(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 100)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--bench":
+        benchmark_detectors(sys.argv[2], sys.argv[3].split(",") if len(sys.argv) > 3 else None)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--pyramid":
+        benchmark_pyramid(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        print("Użycie: python face_recognition_module.py --record <katalog> [n] | "
+              "--bench <katalog|wideo> [detektory] | --pyramid <katalog|wideo> [detektor]")
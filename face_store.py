@@ -0,0 +1,183 @@
+# face_store.py
+"""
+Spakowany magazyn encodingów twarzy.
+
+Wszystkie galerie (known_faces/<user>/gallery.npy) są sklejone w jeden plik
+encodings_<wersja>.npy (N x 128, float32, wiersze jednego użytkownika obok siebie)
+plus tabela known_faces/encodings_store.json: użytkownik -> (pierwszy wiersz, liczba).
+Macierz jest otwierana przez mmap tylko do odczytu i współdzielona przez
+load_users()/MirrorUser i FaceRecognitionModule – start czyta dwa pliki
+niezależnie od liczby katalogów użytkowników.
+
+Przebudowa (po zmianie galerii) pisze nowy plik .npy, a potem podmienia
+tabelę przez os.replace – czytelnicy widzą albo stary, albo nowy magazyn.
+"""
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+BASE_DIR = "known_faces"
+STORE_INDEX = "encodings_store.json"
+GALLERY_FILE = "gallery.npy"     # wszystkie próbki użytkownika (M x 128)
+LEGACY_FILE = "encoding.npy"     # pojedynczy encoding (stary format, nadal czytany)
+
+_lock = threading.Lock()
+_stores = {}    # base_dir -> FaceStore
+_stats = {"builds": 0, "opens": 0}
+
+
+def load_gallery(user_dir):
+    """
+    Galeria użytkownika jako macierz (M x 128) albo None, gdy brak encodingów.
+    Stary pojedynczy encoding.npy traktujemy jak galerię z jedną próbką.
+    """
+    gallery_path = os.path.join(user_dir, GALLERY_FILE)
+    if os.path.isfile(gallery_path):
+        return np.atleast_2d(np.load(gallery_path))
+    encoding_path = os.path.join(user_dir, LEGACY_FILE)
+    if os.path.isfile(encoding_path):
+        return np.atleast_2d(np.load(encoding_path))
+    return None
+
+
+class FaceStore:
+    """Macierz wszystkich próbek (mmap, tylko odczyt) + zakresy wierszy użytkowników."""
+
+    def __init__(self, matrix, users, path=None, mtime=None):
+        self.matrix = matrix
+        self.users = users          # name -> (start, count), w kolejności wierszy
+        self.path = path
+        self.mtime = mtime
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def gallery(self, name):
+        """Widok (bez kopiowania) na próbki użytkownika albo None."""
+        span = self.users.get(name)
+        if span is None:
+            return None
+        start, count = span
+        return self.matrix[start:start + count]
+
+    def select(self, names):
+        """
+        (macierz, nazwy wierszy) dla podanych użytkowników. Gdy tworzą jeden
+        ciągły blok w magazynie – widok na mmap, inaczej kopia tylko ich wierszy.
+        """
+        spans = sorted(self.users[n] + (n,) for n in names if n in self.users)
+        if not spans:
+            return np.empty((0, self.matrix.shape[1]), dtype=np.float32), []
+        row_names = [name for _start, count, name in spans for _ in range(count)]
+        contiguous = all(a[0] + a[1] == b[0] for a, b in zip(spans, spans[1:]))
+        if contiguous:
+            start = spans[0][0]
+            return self.matrix[start:start + len(row_names)], row_names
+        return np.concatenate([self.matrix[s:s + c] for s, c, _n in spans]), row_names
+
+
+def _index_path(base_dir):
+    return os.path.join(base_dir, STORE_INDEX)
+
+
+def build_store(base_dir=BASE_DIR):
+    """Skleja galerie wszystkich użytkowników w nowy plik magazynu i atomowo go publikuje."""
+    t0 = time.perf_counter()
+    users = []
+    chunks = []
+    row = 0
+    if os.path.isdir(base_dir):
+        for name in sorted(os.listdir(base_dir)):
+            user_dir = os.path.join(base_dir, name)
+            if not os.path.isdir(user_dir):
+                continue
+            gallery = load_gallery(user_dir)
+            if gallery is None:
+                continue
+            chunks.append(np.asarray(gallery, dtype=np.float32))
+            users.append([name, row, len(gallery)])
+            row += len(gallery)
+    os.makedirs(base_dir, exist_ok=True)
+    matrix = np.ascontiguousarray(np.concatenate(chunks)) if chunks else np.empty((0, 128), dtype=np.float32)
+
+    data_name = f"encodings_{time.time_ns()}.npy"
+    # prefiks spoza wzorca sprzątania (encodings_*.npy) – równoległy build nie usunie cudzego pliku w zapisie
+    tmp = os.path.join(base_dir, ".tmp_" + data_name)
+    np.save(tmp, matrix)
+    os.replace(tmp, os.path.join(base_dir, data_name))
+
+    index_tmp = _index_path(base_dir) + ".tmp"
+    with open(index_tmp, "w", encoding="utf-8") as f:
+        json.dump({"file": data_name, "users": users, "built_at": time.time()}, f, ensure_ascii=False)
+    os.replace(index_tmp, _index_path(base_dir))
+
+    # stare pliki danych: otwarte mmapy działają dalej (Linux), nowe otwarcia widzą nowy plik
+    for old in glob.glob(os.path.join(base_dir, "encodings_*.npy")):
+        if os.path.basename(old) != data_name:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    with _lock:
+        _stats["builds"] += 1
+    print(f"[FACES] Magazyn encodingów: {len(users)} użytkowników, {row} próbek "
+          f"({(time.perf_counter() - t0) * 1000:.1f} ms)")
+
+
+def _open(base_dir):
+    index_path = _index_path(base_dir)
+    mtime = os.stat(index_path).st_mtime_ns
+    with open(index_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    path = os.path.join(base_dir, meta["file"])
+    matrix = np.load(path, mmap_mode="r")
+    users = {name: (start, count) for name, start, count in meta["users"]}
+    with _lock:
+        _stats["opens"] += 1
+    return FaceStore(matrix, users, path, mtime)
+
+
+def get_store(base_dir=BASE_DIR):
+    """
+    Wspólny magazyn (otwierany raz). Jedno stat() sprawdza, czy ktoś go nie
+    przebudował – wtedy otwieramy nową wersję. Brak magazynu = budujemy z galerii.
+    """
+    index_path = _index_path(base_dir)
+    with _lock:
+        store = _stores.get(base_dir)
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if store is not None and store.mtime == mtime:
+        return store
+    if mtime is None:
+        build_store(base_dir)
+    try:
+        store = _open(base_dir)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[FACES] Uszkodzony magazyn encodingów, przebudowa: {e}")
+        build_store(base_dir)
+        store = _open(base_dir)
+    with _lock:
+        _stores[base_dir] = store
+    return store
+
+
+def stats():
+    with _lock:
+        sizes = {d: len(s) for d, s in _stores.items()}
+    return {**_stats, "rows": sizes}
+
+
+if __name__ == "__main__":
+    # python face_store.py --rebuild   – przebuduj magazyn z known_faces/<user>/gallery.npy
+    if "--rebuild" in sys.argv:
+        build_store()
+    store = get_store()
+    for name, (start, count) in store.users.items():
+        print(f"{name}: {count} próbek (wiersze {start}–{start + count - 1})")
@@ -4,6 +4,7 @@ import time
 from collections import deque
 import threading
 import queue
+import camera_broker
 
 
 class GestureRecognizer(threading.Thread):
@@ -61,13 +62,14 @@ class GestureRecognizer(threading.Thread):
         self._stop_event.set()
 
     def run(self):
-        self.cap = cv2.VideoCapture(self.camera_index, self.camera_backend)
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # shared camera: subscribing does not reopen the device if face recognition just used it
+        self.cap = camera_broker.get_broker(self.camera_index, self.camera_backend).subscribe("gesture")
 
         try:
             while not self._stop_event.is_set():
-                ret, frame = self.cap.read()
-                if not ret:
+                # read-only view into the broker's ring buffer, valid until the next read()
+                frame = self.cap.read(timeout=0.5)
+                if frame is None:
                     continue
 
                 h, w, _ = frame.shape
@@ -180,7 +182,7 @@ class GestureRecognizer(threading.Thread):
 
         finally:
             if self.cap is not None:
-                self.cap.release()
+                self.cap.close()
             self.hands.close()
 
     @staticmethod
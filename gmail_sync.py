@@ -0,0 +1,237 @@
+# gmail_sync.py
+import json
+import os
+import threading
+import time
+from googleapiclient.errors import HttpError
+from google_email import get_gmail_service, get_messages_metadata
+
+STORE_SIZE = 20          # ile najnowszych wiadomości z INBOX trzymamy lokalnie (/user/email pokazuje 10)
+SYNC_INTERVAL = 60       # s – co ile wątek w tle pyta Gmail o zmiany (history.list)
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+_lock = threading.Lock()
+_user_locks = {}   # user_id -> Lock (jedna synchronizacja naraz na użytkownika)
+_stores = {}       # user_id -> store (patrz _empty_store)
+_sync_thread = None
+_stats = {"full_syncs": 0, "delta_syncs": 0, "delta_changes": 0, "metadata_retries": 0, "errors": 0}
+
+
+def _empty_store():
+    return {
+        "history_id": None,
+        "ids": [],          # id wiadomości INBOX, od najnowszej
+        "meta": {},         # id -> nagłówki (google_email._parse_message)
+        "unread": None,     # messagesUnread etykiety INBOX
+        "synced_at": 0.0,
+    }
+
+
+def _store_path(user_id):
+    return f'gmail_store_{user_id}.json'
+
+
+def _user_lock(user_id):
+    with _lock:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.Lock()
+        return lock
+
+
+def _load_store(user_id):
+    path = _store_path(user_id)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Gmail] Uszkodzony magazyn {path}, pełna synchronizacja: {e}")
+    return _empty_store()
+
+
+def _save_store(user_id, store):
+    path = _store_path(user_id)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(store, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _get_store(user_id):
+    with _lock:
+        store = _stores.get(user_id)
+    if store is None:
+        store = _load_store(user_id)
+        with _lock:
+            store = _stores.setdefault(user_id, store)
+    return store
+
+
+# ---------------- Synchronizacja ----------------
+def _full_sync(user_id, service):
+    # historyId bierzemy PRZED listowaniem – zmiany w międzyczasie złapie kolejna delta
+    history_id = service.users().getProfile(userId='me').execute()['historyId']
+    result = service.users().messages().list(
+        userId='me', labelIds=['INBOX'], maxResults=STORE_SIZE
+    ).execute()
+    ids = [m['id'] for m in result.get('messages', [])]
+    meta = get_messages_metadata(user_id, ids, service=service)
+    label = service.users().labels().get(userId='me', id='INBOX').execute()
+
+    store = _empty_store()
+    store["history_id"] = history_id
+    store["ids"] = [mid for mid in ids if mid in meta]
+    store["meta"] = {mid: meta[mid] for mid in store["ids"]}
+    store["unread"] = label.get('messagesUnread', 0)
+    _stats["full_syncs"] += 1
+    return store
+
+
+def _delta_sync(user_id, service, store):
+    """Zwraca zaktualizowany store albo None, gdy historyId wygasł (trzeba pełnej synchronizacji)."""
+    added, removed = set(), set()
+    records = 0
+    page_token = None
+    history_id = store["history_id"]
+    while True:
+        try:
+            resp = service.users().history().list(
+                userId='me', startHistoryId=store["history_id"], labelId='INBOX',
+                historyTypes=HISTORY_TYPES, pageToken=page_token
+            ).execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                return None
+            raise
+        for record in resp.get('history', []):
+            for item in record.get('messagesAdded', []):
+                msg = item['message']
+                if 'INBOX' in msg.get('labelIds', []):
+                    added.add(msg['id'])
+            for item in record.get('labelsAdded', []):
+                if 'INBOX' in item.get('labelIds', []):
+                    added.add(item['message']['id'])
+            for item in record.get('labelsRemoved', []):
+                if 'INBOX' in item.get('labelIds', []):
+                    removed.add(item['message']['id'])
+            for item in record.get('messagesDeleted', []):
+                removed.add(item['message']['id'])
+        # każdy rekord (też sama zmiana UNREAD) oznacza, że licznik trzeba odświeżyć
+        records += len(resp.get('history', []))
+        history_id = resp.get('historyId', history_id)
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            break
+
+    store_history_id = store["history_id"]
+    store = dict(store)
+    store["history_id"] = history_id
+    if not records:
+        return store
+
+    _stats["delta_syncs"] += 1
+    added -= removed
+    _stats["delta_changes"] += len(added) + len(removed)
+    ids = [mid for mid in store["ids"] if mid not in removed]
+    meta = {mid: store["meta"][mid] for mid in ids}
+
+    new_ids = [mid for mid in added if mid not in meta]
+    fetched = get_messages_metadata(user_id, new_ids, service=service)
+    meta.update(fetched)
+    if len(fetched) < len(new_ids):
+        # nie przesuwamy historyId – kolejna delta powtórzy te zmiany i dociągnie brakujące
+        # nagłówki (pobrane już są w cache google_email, więc nie lecą drugi raz)
+        store["history_id"] = store_history_id
+        _stats["metadata_retries"] += len(new_ids) - len(fetched)
+    ids = sorted(set(ids) | (added & set(meta)), key=lambda mid: meta[mid].get("ts", 0), reverse=True)
+
+    if len(ids) < STORE_SIZE and len(store["ids"]) >= STORE_SIZE:
+        # po usunięciach brakuje starszych wiadomości – taniej przeładować całość
+        return None
+
+    store["ids"] = ids[:STORE_SIZE]
+    store["meta"] = {mid: meta[mid] for mid in store["ids"]}
+    label = service.users().labels().get(userId='me', id='INBOX').execute()
+    store["unread"] = label.get('messagesUnread', 0)
+    return store
+
+
+def sync_user(user_id):
+    """Jedna synchronizacja użytkownika: delta po historyId, a gdy się nie da – pełna."""
+    with _user_lock(user_id):
+        store = _get_store(user_id)
+        service = get_gmail_service(user_id)
+        new_store = None
+        if store.get("history_id"):
+            new_store = _delta_sync(user_id, service, store)
+        if new_store is None:
+            new_store = _full_sync(user_id, service)
+        changed = new_store != store   # synced_at jeszcze stary – porównujemy tylko dane
+        new_store["synced_at"] = time.time()
+        if changed:
+            _save_store(user_id, new_store)
+        with _lock:
+            _stores[user_id] = new_store
+    _ensure_sync_thread()
+    return new_store
+
+
+def _sync_loop():
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        with _lock:
+            user_ids = list(_stores)
+        for user_id in user_ids:
+            try:
+                sync_user(user_id)
+            except Exception as e:
+                _stats["errors"] += 1
+                print(f"[Gmail] Błąd synchronizacji w tle user_id={user_id}: {e}")
+
+
+def _ensure_sync_thread():
+    global _sync_thread
+    with _lock:
+        if _sync_thread and _sync_thread.is_alive():
+            return
+        _sync_thread = threading.Thread(target=_sync_loop, name="gmail_sync", daemon=True)
+        _sync_thread.start()
+
+
+def _ready_store(user_id):
+    """Magazyn użytkownika; synchronicznie tylko przy pierwszym użyciu (pusty magazyn)."""
+    store = _get_store(user_id)
+    if not store.get("history_id"):
+        store = sync_user(user_id)
+    else:
+        _ensure_sync_thread()
+    return store
+
+
+def forget(user_id):
+    """Usuwa lokalne dane użytkownika (np. po unieważnieniu tokenu)."""
+    with _user_lock(user_id):
+        with _lock:
+            _stores.pop(user_id, None)
+        path = _store_path(user_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ---------------- Odczyt (tylko dane lokalne) ----------------
+def get_unread_email_count(user_id=None):
+    return _ready_store(user_id)["unread"]
+
+
+def get_recent_emails(user_id=None, max_results=5):
+    store = _ready_store(user_id)
+    return [store["meta"][mid] for mid in store["ids"][:max_results]]
+
+
+def stats():
+    with _lock:
+        # None = magazyn jeszcze nigdy niezsynchronizowany (synced_at == 0)
+        ages = {str(u): round(time.time() - s["synced_at"], 1) if s.get("synced_at") else None
+                for u, s in _stores.items()}
+    return {**_stats, "age_s": ages}
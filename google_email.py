@@ -1,9 +1,18 @@
-from googleapiclient.discovery import build
-from google_calendar import get_credentials
+from collections import OrderedDict
+import threading
+from google_services import get_service
+
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+METADATA_CACHE_SIZE = 500   # ile wiadomości (nagłówki + snippet) trzymamy w pamięci
+BATCH_LIMIT = 50            # Gmail zaleca maks. 50 zapytań w jednym batchu
+
+# (user_id, message_id) -> dict z nagłówkami; treść nagłówków wiadomości się nie zmienia
+_metadata_cache = OrderedDict()
+_metadata_lock = threading.Lock()
+
 
 def get_gmail_service(user_id=None):
-    creds = get_credentials(user_id)
-    return build('gmail', 'v1', credentials=creds)
+    return get_service(user_id, 'gmail')
 
 
 def get_unread_email_count(user_id=None):
@@ -12,6 +21,82 @@ def get_unread_email_count(user_id=None):
     return label.get('messagesUnread', 0)
 
 
+def _parse_message(msg):
+    headers = {
+        h['name']: h['value']
+        for h in msg.get('payload', {}).get('headers', [])
+    }
+    return {
+        "id": msg["id"],
+        "subject": headers.get("Subject", "(brak tematu)"),
+        "from": headers.get("From", ""),
+        "date": headers.get("Date", ""),
+        "snippet": msg.get("snippet", ""),
+        "ts": int(msg.get("internalDate", 0))  # ms – do sortowania w gmail_sync
+    }
+
+
+def _cache_get(key):
+    with _metadata_lock:
+        item = _metadata_cache.get(key)
+        if item is not None:
+            _metadata_cache.move_to_end(key)
+        return item
+
+
+def _cache_put(key, item):
+    with _metadata_lock:
+        _metadata_cache[key] = item
+        _metadata_cache.move_to_end(key)
+        while len(_metadata_cache) > METADATA_CACHE_SIZE:
+            _metadata_cache.popitem(last=False)
+
+
+def get_messages_metadata(user_id, message_ids, service=None):
+    """
+    Nagłówki dla listy id wiadomości: z cache, a brakujące jednym zapytaniem
+    batch (zamiast osobnego messages.get dla każdej wiadomości).
+    Zwraca dict: message_id -> dict; wiadomości, których nie udało się pobrać, są pomijane.
+    """
+    found = {}
+    missing = []
+    for mid in message_ids:
+        item = _cache_get((user_id, mid))
+        if item is not None:
+            found[mid] = item
+        else:
+            missing.append(mid)
+
+    if not missing:
+        return found
+
+    service = service or get_gmail_service(user_id)
+
+    def on_message(request_id, response, exception):
+        if exception is not None:
+            print(f"[Gmail] Błąd pobierania wiadomości {request_id}: {exception}")
+            return
+        item = _parse_message(response)
+        _cache_put((user_id, request_id), item)
+        found[request_id] = item
+
+    for i in range(0, len(missing), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=on_message)
+        for mid in missing[i:i + BATCH_LIMIT]:
+            batch.add(
+                service.users().messages().get(
+                    userId='me',
+                    id=mid,
+                    format='metadata',
+                    metadataHeaders=METADATA_HEADERS
+                ),
+                request_id=mid
+            )
+        batch.execute()
+
+    return found
+
+
 def get_recent_emails(user_id=None, max_results=5):
     service = get_gmail_service(user_id)
     result = service.users().messages().list(
@@ -21,26 +106,6 @@ def get_recent_emails(user_id=None, max_results=5):
         q=''   # tu kiedyś możesz dodać np. 'is:unread'
     ).execute()
 
-    messages = []
-    for meta in result.get('messages', []):
-        msg = service.users().messages().get(
-            userId='me',
-            id=meta['id'],
-            format='metadata',
-            metadataHeaders=['Subject', 'From', 'Date']
-        ).execute()
-
-        headers = {
-            h['name']: h['value']
-            for h in msg.get('payload', {}).get('headers', [])
-        }
-
-        messages.append({
-            "id": msg["id"],
-            "subject": headers.get("Subject", "(brak tematu)"),
-            "from": headers.get("From", ""),
-            "date": headers.get("Date", ""),
-            "snippet": msg.get("snippet", "")
-        })
-
-    return messages
+    ids = [meta['id'] for meta in result.get('messages', [])]
+    metadata = get_messages_metadata(user_id, ids, service=service)
+    return [metadata[mid] for mid in ids if mid in metadata]
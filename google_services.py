@@ -0,0 +1,264 @@
+# google_services.py
+from googleapiclient.discovery import build, build_from_document, fix_method_name
+from googleapiclient import discovery_cache
+from google.auth.credentials import AnonymousCredentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
+from datetime import datetime, timedelta
+import json
+import pickle
+import os.path
+import sys
+import threading
+import time
+
+SCOPES = [
+    'https://www.googleapis.com/auth/calendar.readonly',
+    'https://www.googleapis.com/auth/tasks.readonly',
+    'https://www.googleapis.com/auth/gmail.readonly' #gmail
+]
+
+API_VERSIONS = {"calendar": "v3", "tasks": "v1", "gmail": "v1"}
+
+# Przypięte dokumenty discovery (odświeżanie: python google_services.py --pin)
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery")
+
+REFRESH_MARGIN = 300          # s – odświeżamy token, gdy do wygaśnięcia zostało mniej
+REFRESH_CHECK_INTERVAL = 60   # s – co ile wątek w tle sprawdza tokeny
+
+_lock = threading.Lock()
+_user_locks = {}     # user_id -> Lock (ładowanie/odświeżanie tokenu jednego użytkownika)
+_creds = {}          # user_id -> Credentials (wczytane raz z dysku)
+_saved_tokens = {}   # user_id -> (token, refresh_token) ostatnio zapisane na dysk
+_generation = {}     # user_id -> int, zmieniany przy invalidate() (wymusza nowe serwisy)
+_local = threading.local()   # per wątek: (user_id, api) -> (generation, service)
+_discovery_docs = {}  # api -> sparsowany dokument discovery (wspólny dla wszystkich build)
+_refresher = None
+_stats = {"discovery_loads": 0, "token_loads": 0, "token_writes": 0, "refreshes": 0, "service_builds": 0}
+
+
+def _token_path(user_id):
+    if user_id is not None:
+        return f'token_{user_id}.pickle'
+    return 'token.pickle'
+
+
+def _user_lock(user_id):
+    with _lock:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.Lock()
+        return lock
+
+
+def _save_token(user_id, creds):
+    """Zapisuje token tylko wtedy, gdy faktycznie się zmienił."""
+    state = (creds.token, creds.refresh_token)
+    if _saved_tokens.get(user_id) == state:
+        return
+    with open(_token_path(user_id), 'wb') as token:
+        pickle.dump(creds, token)
+    _saved_tokens[user_id] = state
+    _stats["token_writes"] += 1
+
+
+def _expires_soon(creds, margin=REFRESH_MARGIN):
+    if creds.expiry is None:
+        return False
+    # google-auth trzyma expiry jako naiwny datetime w UTC
+    return creds.expiry - datetime.utcnow() < timedelta(seconds=margin)
+
+
+def _run_authorization_flow():
+    flow = InstalledAppFlow.from_client_secrets_file(
+        'credentials.json', SCOPES
+    )
+    # Nie otwieraj domyślnej przeglądarki (w3m w terminalu),
+    # tylko wypisz URL w logu.
+    return flow.run_local_server(
+        host='localhost',
+        port=8080,  # może być też 0, jeśli 8080 zajęty
+        authorization_prompt_message='[GOOGLE] Otwórz ten adres w przeglądarce: {url}',
+        success_message='[GOOGLE] Autoryzacja zakończona, możesz zamknąć okno.',
+        open_browser=False,
+    )
+
+
+def get_credentials(user_id=None):
+    """
+    Zwraca poświadczenia użytkownika z pamięci; plik token_<user_id>.pickle
+    jest czytany tylko raz. Gdy tokenu nie ma – uruchamia autoryzację.
+    Wygasający token jest odświeżany (i zapisywany) tutaj albo w tle.
+    """
+    with _user_lock(user_id):
+        creds = _creds.get(user_id)
+        if creds is None:
+            token_path = _token_path(user_id)
+            if os.path.exists(token_path):
+                with open(token_path, 'rb') as token:
+                    creds = pickle.load(token)
+                _saved_tokens[user_id] = (creds.token, creds.refresh_token)
+                _stats["token_loads"] += 1
+
+        if not creds or not creds.valid or _expires_soon(creds, margin=0):
+            if creds and creds.refresh_token:
+                creds.refresh(Request())
+                _stats["refreshes"] += 1
+            else:
+                creds = _run_authorization_flow()
+            _save_token(user_id, creds)
+
+        _creds[user_id] = creds
+    _ensure_refresher()
+    return creds
+
+
+# ---------------- Dokumenty discovery ----------------
+def _read_discovery_doc(api, version):
+    """Przypięty dokument z DISCOVERY_DIR, a gdy go brak – kopia dołączona do googleapiclient."""
+    path = os.path.join(DISCOVERY_DIR, f"{api}.{version}.json")
+    if os.path.isfile(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    text = discovery_cache.get_static_doc(api, version)
+    if text is None:
+        raise RuntimeError(f"Brak dokumentu discovery dla {api}.{version}")
+    return json.loads(text)
+
+
+def _touch_resources(resource, desc):
+    """Tworzy wszystkie zagnieżdżone zasoby, żeby googleapiclient raz uzupełnił dokument."""
+    for name, sub_desc in desc.get("resources", {}).items():
+        _touch_resources(getattr(resource, fix_method_name(name))(), sub_desc)
+
+
+def load_discovery_docs():
+    """
+    Wczytuje i parsuje dokumenty discovery raz na proces. googleapiclient
+    dopisuje do dokumentu parametry przy tworzeniu metod – robimy to tu,
+    jednowątkowo, więc później build_from_document tylko czyta wspólny dict.
+    """
+    with _lock:
+        for api, version in API_VERSIONS.items():
+            if api in _discovery_docs:
+                continue
+            doc = _read_discovery_doc(api, version)
+            service = build_from_document(doc, credentials=AnonymousCredentials())
+            _touch_resources(service, doc)
+            _discovery_docs[api] = doc
+            _stats["discovery_loads"] += 1
+
+
+def _build(api, creds):
+    if api not in _discovery_docs:
+        load_discovery_docs()
+    return build_from_document(_discovery_docs[api], credentials=creds)
+
+
+def get_service(user_id, api):
+    """
+    Zbudowany serwis API ('calendar' | 'tasks' | 'gmail') dla użytkownika.
+    httplib2 nie jest bezpieczny wątkowo, więc każdy wątek puli ma własne
+    instancje – budowane raz i trzymane do invalidate().
+    """
+    cache = getattr(_local, "services", None)
+    if cache is None:
+        cache = _local.services = {}
+    gen = _generation.get(user_id, 0)
+    entry = cache.get((user_id, api))
+    if entry is not None and entry[0] == gen:
+        return entry[1]
+
+    creds = get_credentials(user_id)
+    service = _build(api, creds)
+    with _lock:
+        _stats["service_builds"] += 1
+    cache[(user_id, api)] = (gen, service)
+    return service
+
+
+def invalidate(user_id):
+    """Zapomina poświadczenia i serwisy użytkownika (np. po usunięciu tokenu)."""
+    with _user_lock(user_id):
+        _creds.pop(user_id, None)
+        _saved_tokens.pop(user_id, None)
+        with _lock:
+            _generation[user_id] = _generation.get(user_id, 0) + 1
+
+
+# ---------------- Odświeżanie w tle ----------------
+def _refresh_loop():
+    while True:
+        time.sleep(REFRESH_CHECK_INTERVAL)
+        for user_id in list(_creds):
+            lock = _user_lock(user_id)
+            with lock:
+                creds = _creds.get(user_id)
+                if creds is None or not creds.refresh_token or not _expires_soon(creds):
+                    continue
+                try:
+                    creds.refresh(Request())
+                    _stats["refreshes"] += 1
+                    _save_token(user_id, creds)
+                    print(f"[GOOGLE] Token user_id={user_id} odświeżony w tle.")
+                except RefreshError as e:
+                    # następne zapytanie wczyta token od nowa i zgłosi błąd wyżej
+                    print(f"[GOOGLE] Nie udało się odświeżyć tokenu user_id={user_id}: {e}")
+                    _creds.pop(user_id, None)
+                except Exception as e:
+                    print(f"[GOOGLE] Błąd odświeżania tokenu user_id={user_id}: {e}")
+
+
+def _ensure_refresher():
+    global _refresher
+    with _lock:
+        if _refresher and _refresher.is_alive():
+            return
+        _refresher = threading.Thread(target=_refresh_loop, name="google_token_refresher", daemon=True)
+        _refresher.start()
+
+
+def stats():
+    with _lock:
+        return {**_stats, "users": sorted(str(u) for u in _creds)}
+
+
+# ---------------- Narzędzia ----------------
+def pin_discovery_docs():
+    """Kopiuje dokumenty discovery z zainstalowanego googleapiclient do DISCOVERY_DIR."""
+    os.makedirs(DISCOVERY_DIR, exist_ok=True)
+    for api, version in API_VERSIONS.items():
+        text = discovery_cache.get_static_doc(api, version)
+        path = os.path.join(DISCOVERY_DIR, f"{api}.{version}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"[GOOGLE] Zapisano {path} (revision {json.loads(text).get('revision')})")
+
+
+def benchmark_service_build(rounds=20):
+    """Średni czas budowy serwisu: build() z dokumentem z pakietu vs wspólny dokument w pamięci."""
+    creds = AnonymousCredentials()
+    t0 = time.perf_counter()
+    load_discovery_docs()
+    print(f"[BENCH] load_discovery_docs (jednorazowo): {(time.perf_counter() - t0) * 1000:.1f} ms")
+    for api, version in API_VERSIONS.items():
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            build(api, version, credentials=creds, static_discovery=True)
+        before = (time.perf_counter() - t0) * 1000 / rounds
+
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            _build(api, creds)
+        after = (time.perf_counter() - t0) * 1000 / rounds
+        print(f"[BENCH] {api}.{version}: build() {before:.1f} ms -> build_from_document {after:.1f} ms")
+
+
+if __name__ == "__main__":
+    # python google_services.py --pin      – przypnij dokumenty discovery w ./discovery
+    # python google_services.py --bench    – porównaj czas budowy serwisów
+    if "--pin" in sys.argv:
+        pin_discovery_docs()
+    if "--bench" in sys.argv:
+        benchmark_service_build()
@@ -0,0 +1,58 @@
+# http_client.py
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) w sekundach – żadne zapytanie nie może wisieć w nieskończoność
+DEFAULT_TIMEOUT = (3.05, 10)
+
+POOL_HOSTS = 8      # ile hostów trzymamy w puli (pogoda, iCloud, OpenRouter, ...)
+POOL_MAXSIZE = 8    # połączeń keep-alive na host (równoległe widżety)
+
+_RETRY = Retry(
+    total=2,
+    connect=2,
+    read=1,
+    backoff_factor=0.5,                          # 0.5 s, 1 s
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "HEAD"}),  # POST (np. OpenRouter) nie jest powtarzany
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Wspólna sesja requests dla wszystkich integracji:
+    pula połączeń per host + keep-alive, więc handshake TLS płacimy raz,
+    a nie przy każdym renderze widżetu.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_HOSTS,
+                                      pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=_RETRY)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
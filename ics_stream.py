@@ -0,0 +1,279 @@
+# ics_stream.py
+"""
+Strumieniowy parser ICS (RFC 5545) ograniczony do okna czasowego.
+
+Zamiast budować cały kalendarz w pamięci (ics.Calendar), czyta linie po kolei
+i materializuje tylko wydarzenia, które przecinają okno [window_start, window_end).
+Powtarzające się wydarzenia (RRULE/RDATE/EXDATE) są rozwijane leniwie, wyłącznie
+w obrębie okna. Zwykłe wydarzenia są zwracane od razu; wystąpienia cykliczne na
+końcu strumienia, bo dopiero wtedy znamy wszystkie nadpisania (RECURRENCE-ID).
+"""
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import re
+from dateutil.rrule import rrulestr
+
+DEFAULT_TZ = ZoneInfo("Europe/Warsaw")
+
+# z VEVENT zbieramy tylko to, czego potrzebuje widżet (opisy, załączniki itd. są pomijane)
+_WANTED = {"UID", "SUMMARY", "DTSTART", "DTEND", "DURATION", "RRULE", "RDATE",
+           "EXDATE", "RECURRENCE-ID", "STATUS"}
+_DURATION_RE = re.compile(
+    r"^(?P<sign>[+-])?P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+
+
+# ---------------- Linie i właściwości ----------------
+def unfold_lines(lines):
+    """Skleja linie zawinięte (kontynuacja zaczyna się spacją lub tabem)."""
+    current = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.rstrip("\r\n")
+        if not line:
+            # iter_lines() zwraca pustą linię, gdy para \r\n wypada na granicy kawałków –
+            # nie może przerwać zawinięcia (RFC 5545 i tak nie ma pustych linii)
+            continue
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def parse_property(line):
+    """'DTSTART;TZID=Europe/Warsaw:20240101T100000' -> ('DTSTART', {'TZID': ...}, '2024...')."""
+    in_quotes = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == ":" and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return None, {}, ""
+    parts = head.split(";")
+    params = {}
+    for part in parts[1:]:
+        key, _, val = part.partition("=")
+        params[key.upper()] = val.strip('"')
+    return parts[0].upper(), params, value
+
+
+def _unescape(text):
+    return (text.replace("\\n", "\n").replace("\\N", "\n")
+            .replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\"))
+
+
+def _tz(params, default_tz):
+    tzid = params.get("TZID")
+    if not tzid:
+        return default_tz
+    try:
+        return ZoneInfo(tzid.strip("/"))
+    except (ZoneInfoNotFoundError, ValueError):
+        return default_tz
+
+
+def parse_datetime(value, params, default_tz):
+    """
+    Wartość DATE / DATE-TIME -> (świadomy datetime, all_day).
+    Daty całodniowe to północ w strefie lokalnej; czas "pływający" też traktujemy jako lokalny.
+    """
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        d = datetime.strptime(value[:8], "%Y%m%d")
+        return d.replace(tzinfo=default_tz), True
+    if value.endswith("Z"):
+        return datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc), False
+    return datetime.strptime(value, "%Y%m%dT%H%M%S").replace(tzinfo=_tz(params, default_tz)), False
+
+
+def parse_duration(value):
+    m = _DURATION_RE.match(value.strip())
+    if not m:
+        return None
+    delta = timedelta(
+        weeks=int(m.group("weeks") or 0), days=int(m.group("days") or 0),
+        hours=int(m.group("hours") or 0), minutes=int(m.group("minutes") or 0),
+        seconds=int(m.group("seconds") or 0),
+    )
+    return -delta if m.group("sign") == "-" else delta
+
+
+# ---------------- Wydarzenia ----------------
+def _occurrence(props, start, end, all_day):
+    return {
+        "uid": props.get("UID", ("", {}, ""))[2],
+        "title": _unescape(props.get("SUMMARY", ("", {}, "Bez tytułu"))[2]) or "Bez tytułu",
+        "start": start,
+        "end": end,
+        "all_day": all_day,
+    }
+
+
+def _intersects(start, end, window_start, window_end):
+    return start < window_end and (end > window_start or (end == start and start >= window_start))
+
+
+def _date_list(prop_values, default_tz):
+    """Wszystkie wartości EXDATE/RDATE (mogą być po kilka w linii i w kilku liniach)."""
+    result = []
+    for params, value in prop_values:
+        for item in value.split(","):
+            if item:
+                result.append(parse_datetime(item, params, default_tz)[0])
+    return result
+
+
+def _normalize_until(rrule_value, all_day):
+    """
+    UNTIL tego samego typu co DTSTART (inaczej rrulestr rzuca ValueError):
+    przy DTSTART-dacie sama data (Apple/Google eksportują UNTIL=...T000000Z dla urodzin),
+    przy DTSTART z godziną – koniec dnia w UTC dla samej daty i 'Z' dla czasu bez strefy.
+    """
+    if all_day:
+        return re.sub(r"UNTIL=(\d{8})T\d{6}Z?", r"UNTIL=\1", rrule_value)
+    rrule_value = re.sub(r"UNTIL=(\d{8})(?![\dT])", r"UNTIL=\1T235959Z", rrule_value)
+    return re.sub(r"(UNTIL=\d{8}T\d{6})(?!Z)", r"\1Z", rrule_value)
+
+
+def _expand(props, multi, start, duration, all_day, window_start, window_end, default_tz):
+    """Leniwe wystąpienia wydarzenia cyklicznego przecinające okno."""
+    excluded = set(_date_list(multi.get("EXDATE", []), default_tz))
+    rrule_value = props["RRULE"][2] if "RRULE" in props else None
+    # wystąpienie zaczynające się przed oknem może jeszcze trwać
+    search_from = window_start - duration
+
+    starts = []
+    if rrule_value:
+        rrule_value = _normalize_until(rrule_value, all_day)
+        try:
+            if all_day:
+                # reguły całodniowe liczymy w czasie "naiwnym" (UNTIL jest wtedy samą datą)
+                rule = rrulestr(f"RRULE:{rrule_value}", dtstart=start.replace(tzinfo=None))
+                occurrences = (occ.replace(tzinfo=default_tz)
+                               for occ in rule.xafter(search_from.replace(tzinfo=None), inc=True))
+            else:
+                rule = rrulestr(f"RRULE:{rrule_value}", dtstart=start)
+                occurrences = rule.xafter(search_from, inc=True)
+            for occ in occurrences:
+                if occ >= window_end:
+                    break
+                starts.append(occ)
+        except ValueError as e:
+            # nieczytelna reguła – zostaje przynajmniej samo DTSTART zamiast znikającej serii
+            print(f"[ICS] Nieczytelna reguła RRULE:{rrule_value} ({e}) – tylko pierwsze wystąpienie")
+            starts = [start] if search_from <= start < window_end else []
+    starts.extend(d for d in _date_list(multi.get("RDATE", []), default_tz)
+                  if search_from <= d < window_end)
+
+    for occ_start in sorted(set(starts)):
+        if occ_start in excluded:
+            continue
+        occ_end = occ_start + duration
+        if _intersects(occ_start, occ_end, window_start, window_end):
+            yield occ_start, occ_end
+
+
+def iter_window_events(lines, window_start, window_end, default_tz=DEFAULT_TZ):
+    """
+    Generator wystąpień wydarzeń z okna [window_start, window_end) – słowniki
+    {"uid", "title", "start", "end", "all_day"} ze świadomymi datetime.
+    lines – dowolny iterowalny strumień linii (np. Response.iter_lines()).
+    """
+    recurring = []      # (props, start, end, all_day) wystąpień cyklicznych z okna
+    overrides = {}      # (uid, recurrence_id) -> wystąpienie zastępcze albo None (odwołane)
+    props = None
+    multi = None
+    depth = 0           # zagnieżdżenie wewnątrz VEVENT (np. VALARM)
+
+    for line in unfold_lines(lines):
+        name, params, value = parse_property(line)
+        if name is None:
+            continue
+        if name == "BEGIN":
+            if value.upper() == "VEVENT" and props is None:
+                props, multi, depth = {}, {}, 0
+            elif props is not None:
+                depth += 1
+            continue
+        if name == "END":
+            if props is None:
+                continue
+            if depth:
+                depth -= 1
+                continue
+            if value.upper() == "VEVENT":
+                yield from _finish_event(props, multi, recurring, overrides,
+                                         window_start, window_end, default_tz)
+                props = multi = None
+            continue
+        if props is None or depth or name not in _WANTED:
+            continue
+        if name in ("EXDATE", "RDATE"):
+            multi.setdefault(name, []).append((params, value))
+        else:
+            props[name] = (name, params, value)
+
+    # wystąpienia cykliczne po uwzględnieniu nadpisań z RECURRENCE-ID
+    for occ_props, start, end, all_day in sorted(recurring, key=lambda item: item[1]):
+        key = (occ_props.get("UID", ("", {}, ""))[2], start)
+        if key in overrides:
+            continue
+        yield _occurrence(occ_props, start, end, all_day)
+    for occ in overrides.values():
+        if occ is not None:
+            yield occ
+
+
+def _finish_event(props, multi, recurring, overrides, window_start, window_end, default_tz):
+    if "DTSTART" not in props:
+        return
+    cancelled = props.get("STATUS", ("", {}, ""))[2].upper() == "CANCELLED"
+    try:
+        start, all_day = parse_datetime(props["DTSTART"][2], props["DTSTART"][1], default_tz)
+        if "DTEND" in props:
+            end = parse_datetime(props["DTEND"][2], props["DTEND"][1], default_tz)[0]
+        elif "DURATION" in props:
+            end = start + (parse_duration(props["DURATION"][2]) or timedelta())
+        else:
+            end = start + (timedelta(days=1) if all_day else timedelta())
+    except ValueError as e:
+        print(f"[ICS] Pominięto wydarzenie z błędną datą: {e}")
+        return
+    duration = max(end - start, timedelta())
+
+    if "RECURRENCE-ID" in props:
+        # zmienione/odwołane pojedyncze wystąpienie serii
+        _, rid_params, rid_value = props["RECURRENCE-ID"]
+        try:
+            rid = parse_datetime(rid_value, rid_params, default_tz)[0]
+        except ValueError:
+            return
+        uid = props.get("UID", ("", {}, ""))[2]
+        if cancelled or not _intersects(start, end, window_start, window_end):
+            overrides[(uid, rid)] = None
+        else:
+            overrides[(uid, rid)] = _occurrence(props, start, end, all_day)
+        return
+
+    if cancelled:
+        return
+
+    if "RRULE" in props or "RDATE" in multi:
+        try:
+            for occ_start, occ_end in _expand(props, multi, start, duration, all_day,
+                                              window_start, window_end, default_tz):
+                recurring.append((props, occ_start, occ_end, all_day))
+        except (ValueError, TypeError) as e:
+            print(f"[ICS] Nie udało się rozwinąć RRULE ({props['RRULE'][2] if 'RRULE' in props else ''}): {e}")
+        return
+
+    if _intersects(start, end, window_start, window_end):
+        yield _occurrence(props, start, end, all_day)
@@ -1,12 +1,15 @@
 # mirror_user.py
 class MirrorUser:
-    def __init__(self, user_id, name, calendar_type, email=None, face_encoding=None, calendar_data=None):
+    def __init__(self, user_id, name, calendar_type, email=None, face_encoding=None, calendar_data=None, calendars=None,
+                 face_gallery=None):
         self.user_id = int(user_id)  # rzutuj na int jeśli nie jesteś pewien
         self.name = name
         self.calendar_type = calendar_type
         self.email = email
         self.face_encoding = face_encoding
+        self.face_gallery = face_gallery  # wszystkie próbki (widok na magazyn face_store, tylko odczyt)
         self.calendar_data = calendar_data
+        self.calendars = calendars or []  # dodatkowe kalendarze (Google calendarId / URL ICS)
 
     def __repr__(self):
         return f"<MirrorUser {self.name} ({self.calendar_type})>"
\ No newline at end of file
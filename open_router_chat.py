@@ -1,4 +1,4 @@
-import requests
+import http_client
 import os
 
 API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -34,7 +34,7 @@ def zapytaj_openrouter(prompt: str, modele: list[str] = DARMOWE_MODELE) -> str:
         }
 
         try:
-            response = requests.post(API_URL, headers=headers, json=data, timeout=15)
+            response = http_client.post(API_URL, headers=headers, json=data, timeout=(3.05, 15))
             if response.status_code == 200:
                 result = response.json()
                 odpowiedz = result["choices"][0]["message"]["content"].strip()
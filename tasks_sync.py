@@ -0,0 +1,127 @@
+# tasks_sync.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from google_services import get_service
+from google_calendar import TZ, task_view
+
+LIST_WORKERS = 4             # równoległe zapytania o listy zadań
+REFRESH_MIN_AGE = 30         # s – młodszy indeks zwracamy bez pytania API
+CLOCK_SKEW = timedelta(seconds=30)   # zapas dla updatedMin (zegar Pi vs serwer Google)
+TASK_FIELDS = 'items(id,title,due,status,position,deleted,hidden),nextPageToken'
+
+_executor = ThreadPoolExecutor(max_workers=LIST_WORKERS, thread_name_prefix="tasks_sync")
+_lock = threading.Lock()
+_user_locks = {}   # user_id -> Lock
+_indexes = {}      # user_id -> {"lists": [id], "tasks": {list_id: {task_id: task}}, "since", "synced_at"}
+_stats = {"full_lists": 0, "delta_lists": 0, "delta_changes": 0}
+
+
+def _user_lock(user_id):
+    with _lock:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.Lock()
+        return lock
+
+
+def _list_tasks(user_id, list_id, since=None):
+    """
+    Zadania jednej listy. Bez since: tylko otwarte (filtr po stronie serwera).
+    Z since: wszystkie zmiany od tej chwili, łącznie z ukończonymi/usuniętymi,
+    żeby dało się je wyrzucić z indeksu.
+    """
+    service = get_service(user_id, 'tasks')
+    if since is None:
+        params = {"showCompleted": False, "showHidden": False}
+    else:
+        params = {"showCompleted": True, "showHidden": True, "showDeleted": True,
+                  "updatedMin": since.isoformat().replace('+00:00', 'Z')}
+    items = []
+    page_token = None
+    while True:
+        resp = service.tasks().list(
+            tasklist=list_id, maxResults=100, fields=TASK_FIELDS,
+            pageToken=page_token, **params
+        ).execute()
+        items.extend(resp.get('items', []))
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            return items
+
+
+def _is_open(task):
+    return task.get('status') != 'completed' and not task.get('deleted') and not task.get('hidden')
+
+
+def _refresh(user_id, index):
+    # moment startu liczymy przed zapytaniami – zmiany w trakcie złapie następna delta
+    started = datetime.now(timezone.utc)
+    service = get_service(user_id, 'tasks')
+    tasklists = service.tasklists().list().execute().get('items', [])
+
+    old_tasks = index["tasks"] if index else {}
+    since = index["since"] - CLOCK_SKEW if index else None
+
+    jobs = {}
+    for tasklist in tasklists:
+        list_id = tasklist['id']
+        list_since = since if list_id in old_tasks else None
+        jobs[list_id] = (list_since, _executor.submit(_list_tasks, user_id, list_id, list_since))
+
+    tasks = {}
+    for list_id, (list_since, fut) in jobs.items():
+        items = fut.result()
+        if list_since is None:
+            _stats["full_lists"] += 1
+            tasks[list_id] = {t['id']: t for t in items if _is_open(t)}
+            continue
+        _stats["delta_lists"] += 1
+        _stats["delta_changes"] += len(items)
+        current = dict(old_tasks[list_id])
+        for task in items:
+            if _is_open(task):
+                current[task['id']] = task
+            else:
+                current.pop(task['id'], None)
+        tasks[list_id] = current
+
+    return {
+        "lists": [tl['id'] for tl in tasklists],
+        "tasks": tasks,
+        "since": started,
+        "synced_at": time.time(),
+    }
+
+
+def get_google_tasks(user_id=None):
+    """
+    Otwarte zadania ze wszystkich list, jak google_calendar.get_google_tasks,
+    ale listy są pobierane równolegle, a po pierwszym razie tylko zmiany (updatedMin).
+    """
+    with _user_lock(user_id):
+        index = _indexes.get(user_id)
+        if index is None or time.time() - index["synced_at"] >= REFRESH_MIN_AGE:
+            index = _refresh(user_id, index)
+            with _lock:
+                _indexes[user_id] = index
+
+    today = datetime.now(TZ).date()
+    all_tasks = []
+    for list_id in index["lists"]:
+        for task in sorted(index["tasks"].get(list_id, {}).values(), key=lambda t: t.get('position', '')):
+            all_tasks.append(task_view(task, today))
+    return all_tasks
+
+
+def forget(user_id):
+    with _user_lock(user_id):
+        with _lock:
+            _indexes.pop(user_id, None)
+
+
+def stats():
+    with _lock:
+        ages = {str(u): round(time.time() - i["synced_at"], 1) for u, i in _indexes.items()}
+    return {**_stats, "age_s": ages}
@@ -0,0 +1,142 @@
+# ttl_cache.py
+import threading
+import time
+
+
+class TTLCache:
+    """
+    Prosty cache z TTL dla danych z zewnętrznych API:
+    - świeża wartość (wiek < ttl) jest zwracana od razu,
+    - przeterminowana (ttl <= wiek < ttl + stale_ttl) też jest zwracana od razu,
+      a odświeżenie leci w wątku w tle (stale-while-revalidate),
+    - brak wartości / zbyt stara -> pobranie synchroniczne,
+    - single-flight: dla jednego klucza w locie jest najwyżej jedno pobranie,
+      pozostałe wątki czekają na jego wynik zamiast dublować zapytanie.
+    Liczniki (hits/stale/misses/...) są dostępne przez stats().
+    """
+
+    def __init__(self, name, ttl=600.0, stale_ttl=3600.0):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries = {}    # key -> (value, ts)
+        self._inflight = {}   # key -> threading.Event
+        self._counters = {"hits": 0, "stale": 0, "misses": 0, "waits": 0,
+                          "refreshes": 0, "errors": 0}
+
+    # ---------------- Odczyt ----------------
+    def get(self, key, loader):
+        """
+        Zwraca wartość dla key. loader() jest wołany tylko wtedy, gdy trzeba
+        (brak wartości albo odświeżenie w tle). Wyjątki z loadera przy
+        synchronicznym pobraniu są przekazywane wyżej.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, ts = entry
+                age = now - ts
+                if age < self.ttl:
+                    self._counters["hits"] += 1
+                    return value
+                if age < self.ttl + self.stale_ttl:
+                    self._counters["stale"] += 1
+                    self._start_refresh_locked(key, loader)
+                    return value
+            self._counters["misses"] += 1
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self._inflight[key] = event
+
+        if not owner:
+            # ktoś już pobiera – czekamy na jego wynik
+            with self._lock:
+                self._counters["waits"] += 1
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            # pobranie właściciela się nie udało – spróbuj samodzielnie
+            return self._load(key, loader)
+
+        try:
+            return self._load(key, loader)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def peek(self, key, default=None):
+        """Zwraca wartość z cache bez pobierania (nawet przeterminowaną)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry is not None else default
+
+    def age(self, key):
+        """Wiek wpisu w sekundach albo None, gdy go nie ma."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else time.time() - entry[1]
+
+    # ---------------- Zapis / odświeżanie ----------------
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def refresh_async(self, key, loader):
+        """Wymusza odświeżenie w tle (np. rozgrzanie cache przy starcie)."""
+        with self._lock:
+            self._start_refresh_locked(key, loader)
+
+    def _start_refresh_locked(self, key, loader):
+        if key in self._inflight:
+            return
+        event = threading.Event()
+        self._inflight[key] = event
+
+        def worker():
+            try:
+                self._load(key, loader)
+            except Exception as e:
+                print(f"[CACHE] {self.name}: błąd odświeżania {key!r}: {e}")
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+        threading.Thread(target=worker, name=f"cache_{self.name}", daemon=True).start()
+
+    def _load(self, key, loader):
+        try:
+            value = loader()
+        except Exception:
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._counters["refreshes"] += 1
+        return value
+
+    # ---------------- Statystyki ----------------
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            ages = {str(k): round(now - ts, 1) for k, (_v, ts) in self._entries.items()}
+            return {
+                "name": self.name,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                **self._counters,
+                "inflight": len(self._inflight),
+                "age_s": ages,
+            }
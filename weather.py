@@ -0,0 +1,98 @@
+# weather.py
+import os
+import datetime
+import http_client
+from dotenv import load_dotenv
+from ttl_cache import TTLCache
+
+load_dotenv()  # moduł może być importowany przed load_dotenv() w app.py
+
+weather_API_KEY = os.getenv("OPENWEATHER_API_KEY")
+CITY = "Kraków"
+if not weather_API_KEY:
+    raise RuntimeError("Brak OPENWEATHER_API_KEY w zmiennych środowiskowych.")
+
+FORECAST_SLOTS = 4  # ile 3-godzinnych slotów pokazuje widżet prognozy
+
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))         # s – dane uznawane za świeże
+WEATHER_CACHE_STALE_TTL = float(os.getenv("WEATHER_CACHE_STALE_TTL", "3600"))  # s – ile dłużej podajemy stare dane
+# prognoza OpenWeather zmienia się co 3 h – nie ma sensu pytać o nią tak często jak o bieżące warunki
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", "1800"))
+FORECAST_CACHE_STALE_TTL = float(os.getenv("FORECAST_CACHE_STALE_TTL", "10800"))
+weather_cache = TTLCache("weather", ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_CACHE_STALE_TTL)
+forecast_cache = TTLCache("forecast", ttl=FORECAST_CACHE_TTL, stale_ttl=FORECAST_CACHE_STALE_TTL)
+
+WEATHER_PLACEHOLDER = {"temp": "?", "desc": "Brak danych", "icon": "01d"}
+
+
+def _parse_slot(item):
+    """Wyciąga z elementu listy /forecast (albo odpowiedzi /weather) tylko pola używane w szablonach."""
+    weather = item['weather'][0]
+    return {
+        "time": datetime.datetime.fromtimestamp(item['dt']).strftime('%H:%M'),
+        "temp": round(item['main']['temp']),
+        "desc": weather['description'].capitalize(),
+        "icon": weather['icon'],
+    }
+
+
+def _get_json(endpoint, extra=""):
+    url = (f"https://api.openweathermap.org/data/2.5/{endpoint}?q={CITY}&appid={weather_API_KEY}"
+           f"&units=metric&lang=pl{extra}")
+    response = http_client.get(url)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_current_weather():
+    """Bieżące warunki z /weather (najbliższy slot prognozy bywa nawet 3 h do przodu)."""
+    slot = _parse_slot(_get_json("weather"))
+    return {"temp": slot["temp"], "desc": slot["desc"], "icon": slot["icon"]}
+
+
+def fetch_forecast():
+    """Najbliższe sloty z /forecast (cnt ogranicza rozmiar odpowiedzi)."""
+    slots = [_parse_slot(item) for item in _get_json("forecast", f"&cnt={FORECAST_SLOTS}")['list'][:FORECAST_SLOTS]]
+    if not slots:
+        raise ValueError("pusta lista prognozy")
+    return slots
+
+
+def get_weather_bundle():
+    """
+    (current, forecast) w formacie oczekiwanym przez szablony. Oba zapytania mają
+    osobne wpisy w cache: bieżące warunki odświeżamy co WEATHER_CACHE_TTL,
+    prognozę rzadziej, więc zwykle leci tylko jedno małe zapytanie /weather.
+    """
+    # błędy nie trafiają do cache – kolejny render spróbuje ponownie
+    try:
+        current = weather_cache.get("current", fetch_current_weather)
+    except Exception as e:
+        print("Błąd pobierania pogody:", e)
+        current = dict(WEATHER_PLACEHOLDER)
+    try:
+        forecast = forecast_cache.get("forecast", fetch_forecast)
+    except Exception as e:
+        print("Błąd pobierania prognozy:", e)
+        forecast = []
+    return current, forecast
+
+
+def peek_weather_bundle(default):
+    """(current, forecast) z cache bez pobierania; brakujące części z default."""
+    return (weather_cache.peek("current", default[0]),
+            forecast_cache.peek("forecast", default[1]))
+
+
+def get_weather():
+    return get_weather_bundle()[0]
+
+
+def get_weather_forecast():
+    return get_weather_bundle()[1]
+
+
+def warm_weather_cache():
+    """Rozgrzewa cache w tle, żeby pierwszy render nie czekał na OpenWeather."""
+    weather_cache.refresh_async("current", fetch_current_weather)
+    forecast_cache.refresh_async("forecast", fetch_forecast)
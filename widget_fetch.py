@@ -0,0 +1,119 @@
+# widget_fetch.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FETCH_WORKERS = 6          # tyle, ile źródeł ma /user – Pi nie potrzebuje więcej
+DEFAULT_DEADLINE = 4.0     # s – po tym czasie widżet dostaje placeholder, pobieranie trwa dalej w tle
+
+_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="widget_fetch")
+
+_inflight = set()              # klucze cache odświeżane właśnie w tle
+_overdue = set()               # klucze w toku dłużej niż deadline źródła
+_inflight_lock = threading.Lock()
+_stats = {"overdue": 0}
+
+
+class Source:
+    """
+    Jedno źródło danych widżetu:
+    fn – funkcja bez argumentów pobierająca dane,
+    placeholder – wartość podstawiana przy błędzie lub spóźnieniu,
+    deadline – maksymalny czas (s) od startu pobierania; potem refresh_into()
+    podaje placeholder (on_timeout), a nowe pobrania tego klucza czekają,
+    aż zawieszone wywołanie się skończy.
+    """
+
+    def __init__(self, name, fn, placeholder=None, deadline=DEFAULT_DEADLINE):
+        self.name = name
+        self.fn = fn
+        self.placeholder = placeholder
+        self.deadline = deadline
+
+    def __repr__(self):
+        return f"<Source {self.name} ({self.deadline}s)>"
+
+
+def _run(source, tag):
+    t0 = time.perf_counter()
+    try:
+        return source.fn()
+    finally:
+        dt = (time.perf_counter() - t0) * 1000
+        print(f"[PERF] {tag}: {source.name}: {dt:.1f} ms")
+
+
+def refresh_into(cache, key_prefix, sources, on_result=None, tag="fetch", min_age=0.0, on_timeout=None):
+    """
+    Odświeża źródła w tle do cache pod kluczami (key_prefix, name), bez czekania.
+    Pomija źródła, które są świeższe niż min_age albo już się odświeżają
+    (także te zawieszone ponad deadline – jeden wątek puli na klucz, nie więcej).
+    on_result(name, value) jest wołane w wątku puli po udanym pobraniu,
+    on_timeout(name, placeholder) – gdy źródło nie zdąży przed swoim deadline.
+    Zwraca dict name -> Future dla faktycznie uruchomionych źródeł
+    (zadanie, które jeszcze nie ruszyło, można anulować przez Future.cancel()).
+    """
+    started = {}
+    for source in sources:
+        key = (key_prefix, source.name)
+        age = cache.age(key)
+        if age is not None and age < min_age:
+            continue
+        with _inflight_lock:
+            if key in _inflight:
+                continue
+            _inflight.add(key)
+
+        def job(source=source, key=key):
+            try:
+                value = _run(source, tag)
+                cache.put(key, value)
+            except Exception as e:
+                print(f"[FETCH] {tag}: {source.name}: błąd: {e}")
+                raise
+            finally:
+                _release(key)
+            if on_result is not None:
+                try:
+                    on_result(source.name, value)
+                except Exception as e:
+                    print(f"[FETCH] {tag}: {source.name}: błąd on_result: {e}")
+            return value
+
+        fut = _executor.submit(job)
+        timer = threading.Timer(source.deadline, _deadline_passed,
+                                args=(fut, source, key, tag, on_timeout))
+        timer.daemon = True
+        timer.start()
+        # anulowane przed startem zadanie nie zwolni klucza samo
+        fut.add_done_callback(lambda f, key=key: f.cancelled() and _release(key))
+        fut.add_done_callback(lambda _f, timer=timer: timer.cancel())
+        started[source.name] = fut
+    return started
+
+
+def _deadline_passed(fut, source, key, tag, on_timeout):
+    if fut.done():
+        return
+    with _inflight_lock:
+        if key not in _inflight:
+            return
+        _overdue.add(key)
+        _stats["overdue"] += 1
+    print(f"[PERF] {tag}: {source.name}: przekroczono {source.deadline:.1f} s – placeholder")
+    if on_timeout is not None:
+        try:
+            on_timeout(source.name, source.placeholder)
+        except Exception as e:
+            print(f"[FETCH] {tag}: {source.name}: błąd on_timeout: {e}")
+
+
+def _release(key):
+    with _inflight_lock:
+        _inflight.discard(key)
+        _overdue.discard(key)
+
+
+def stats():
+    with _inflight_lock:
+        return {**_stats, "inflight": len(_inflight), "overdue_now": sorted(map(str, _overdue))}